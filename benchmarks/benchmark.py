@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for requirement registration, sorting and rendering.
+
+Each benchmark is run against chain-shaped graphs, where every requirement
+depends on the previous one, and wide graphs, where every requirement
+depends on a single root. Results are written as JSON so runs from
+different releases can be compared::
+
+    python benchmarks/benchmark.py --output=results.json
+
+Sort benchmarks clear the process-wide sort cache before each run, so they
+measure a cold sort. Render benchmarks run with warm URL caches, as a
+long-running process would.
+"""
+import os
+import sys
+import time
+import platform
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from django.conf import settings as project_settings
+
+if not project_settings.configured:
+    project_settings.configure(
+        MEDIA_URL="/media/",
+        INSTALLED_APPS=["require_media"],
+    )
+
+import django
+from django import template
+
+from require_media import manager
+from require_media.utils import topological_sort
+from require_media.templatetags.require_media_tags import DelayedRequirementsRenderer
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+SHAPES = ["chain", "wide"]
+GROUPS = ["css", "js"]
+
+def build_declarations(shape, size):
+    """
+    Return (name, group, depends_on) triples for a graph of the given shape.
+    """
+    declarations = []
+    for index in range(size):
+        group = GROUPS[index % 2]
+        name = "requirement-%d.%s" % (index, group)
+        if index == 0:
+            depends_on = []
+        elif shape == "chain":
+            depends_on = [declarations[index - 1][0]]
+        else:
+            depends_on = [declarations[0][0]]
+        declarations.append((name, group, depends_on))
+    return declarations
+
+def build_manager(declarations, inline=False):
+    requirement_manager = manager.RequirementManager()
+    for name, group, depends_on in declarations:
+        if inline:
+            requirement_manager.add_inline(name, u"", group, depends_on)
+        else:
+            requirement_manager.add_external(name, group, depends_on)
+    return requirement_manager
+
+def bench_add_external(declarations):
+    def run():
+        build_manager(declarations)
+    return None, run
+
+def bench_add_inline(declarations):
+    def run():
+        build_manager(declarations, inline=True)
+    return None, run
+
+def bench_topological_sort(declarations):
+    graph = build_manager(declarations).graph
+    def run():
+        topological_sort(graph)
+    return None, run
+
+def bench_sorted_for_groups(declarations):
+    def setup():
+        manager.sort_cache.clear()
+        return build_manager(declarations)
+    def run(requirement_manager):
+        requirement_manager.get_sorted_requirements_for_groups(GROUPS)
+    return setup, run
+
+def bench_render(declarations):
+    context = template.Context({})
+    def setup():
+        requirement_manager = build_manager(declarations)
+        requirement_manager.get_sorted_requirements()
+        return DelayedRequirementsRenderer(requirement_manager, GROUPS, context)
+    def run(renderer):
+        unicode(renderer)
+    # Warm the URL cache once
+    run(setup())
+    return setup, run
+
+BENCHMARKS = [
+    ("add_external", bench_add_external),
+    ("add_inline", bench_add_inline),
+    ("topological_sort", bench_topological_sort),
+    ("get_sorted_requirements_for_groups", bench_sorted_for_groups),
+    ("render", bench_render),
+]
+
+def measure(setup, run, repeat):
+    """
+    Time ``repeat`` calls of ``run``, each with fresh untimed setup.
+    """
+    timings = []
+    for i in range(repeat):
+        if setup is None:
+            start = time.time()
+            run()
+        else:
+            state = setup()
+            start = time.time()
+            run(state)
+        timings.append(time.time() - start)
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "min": timings[0],
+        "median": timings[len(timings) // 2],
+        "mean": sum(timings) / len(timings),
+    }
+
+def run_benchmarks(sizes, names=None):
+    results = []
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        for shape in SHAPES:
+            for size in sizes:
+                declarations = build_declarations(shape, size)
+                setup, run = benchmark(declarations)
+                repeat = max(3, min(100, 10000 // size))
+                result = measure(setup, run, repeat)
+                result.update({"benchmark": name, "shape": shape, "size": size})
+                results.append(result)
+                sys.stderr.write("%-36s %-6s %6d  %.6fs\n" % (name, shape, size, result["median"]))
+    return results
+
+def main():
+    parser = OptionParser(usage="%prog [options] [benchmark ...]")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="The file to write JSON results to. Defaults to standard output.")
+    parser.add_option("-s", "--sizes", dest="sizes", default=",".join([str(size) for size in DEFAULT_SIZES]),
+                      help="A comma separated list of graph sizes.")
+    options, names = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(",")]
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "platform": platform.platform(),
+        },
+        "results": run_benchmarks(sizes, names),
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        output_file = open(options.output, "w")
+        try:
+            output_file.write(output)
+        finally:
+            output_file.close()
+    else:
+        sys.stdout.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,8 @@ setup(
     author = 'Jeff Kistler',
     author_email = 'jeff@jeffkistler.com',
     url = 'https://github.com/jeffkistler/django-require-media',
-    packages = ['require_media', 'require_media.templatetags'],
+    packages = ['require_media', 'require_media.templatetags',
+                'require_media.management', 'require_media.management.commands'],
     package_dir = {'': 'src'},
     classifiers = [
         'Development Status :: 3 - Alpha',
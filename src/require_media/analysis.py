@@ -0,0 +1,230 @@
+"""
+Static analysis of the requirements templates declare.
+
+Requirement tags are fully resolved when a template is compiled, so the set
+of requirements a template may register, and their order, can be computed
+without rendering it. Requirements inside conditional blocks are included,
+so the result is an upper bound on what a render registers.
+"""
+import os
+import sys
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings as project_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.template.loader_tags import ExtendsNode, BlockNode
+
+from require_media.manager import RequirementManager
+from require_media.utils import CyclicDependencyError
+
+#: The version of the manifest format
+MANIFEST_VERSION = 1
+
+def get_template_dirs():
+    """
+    Return the project and application template directories.
+    """
+    dirs = list(project_settings.TEMPLATE_DIRS)
+    try:
+        from django.template.loaders.app_directories import app_template_dirs
+        dirs.extend(app_template_dirs)
+    except ImportError:
+        pass
+    return dirs
+
+def find_templates(template_dirs=None):
+    """
+    Return the sorted names of all templates in the given directories.
+    """
+    if template_dirs is None:
+        template_dirs = get_template_dirs()
+    names = set()
+    for template_dir in template_dirs:
+        for root, dirs, files in os.walk(template_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in files:
+                if filename.startswith("."):
+                    continue
+                path = os.path.join(root, filename)
+                name = path[len(template_dir):].lstrip(os.sep)
+                names.add(name.replace(os.sep, "/"))
+    return sorted(names)
+
+def get_literal(expression):
+    """
+    Return the string literal a template name expression always resolves
+    to, if any.
+
+    Accepts a plain string or a filter expression, whose ``var`` is the
+    resolved string for a constant and a ``Variable`` otherwise.
+    """
+    if isinstance(expression, basestring):
+        return expression
+    if getattr(expression, "filters", None):
+        return None
+    var = getattr(expression, "var", None)
+    if isinstance(var, basestring):
+        return var
+    literal = getattr(var, "literal", None)
+    if isinstance(literal, basestring):
+        return literal
+    return None
+
+def get_constant_template(node):
+    """
+    Return the compiled template an include node always renders, if any.
+    """
+    template = getattr(node, "template", None)
+    if hasattr(template, "nodelist"):
+        return template
+    literal = get_literal(getattr(node, "template_name", None) or template)
+    if literal is not None:
+        return get_template(literal)
+    return None
+
+def is_block_super(node):
+    """
+    Does a node output ``{{ block.super }}``?
+    """
+    expression = getattr(node, "filter_expression", None)
+    var = getattr(expression, "var", None)
+    return getattr(var, "var", None) == "block.super"
+
+def iter_requirement_nodes(nodelist, blocks=None, seen=None, super_blocks=()):
+    """
+    Yield the requirement nodes of a nodelist in rendering order.
+
+    ``blocks`` maps block names to lists of the overriding ``BlockNode``
+    instances from descendant templates, the most derived first.
+    ``super_blocks`` are the blocks ``{{ block.super }}`` renders within
+    the nodelist.
+    """
+    from require_media.templatetags.require_media_tags import RequireNode, RequireInlineNode
+    if blocks is None:
+        blocks = {}
+    if seen is None:
+        seen = set()
+    for node in nodelist:
+        if isinstance(node, (RequireNode, RequireInlineNode)):
+            yield node
+        elif isinstance(node, ExtendsNode):
+            parent_name = get_literal(node.parent_name)
+            if parent_name is None:
+                # The parent is chosen at render time
+                continue
+            merged = dict(blocks)
+            for name, block in node.blocks.items():
+                merged[name] = blocks.get(name, []) + [block]
+            parent = get_template(parent_name)
+            for child in iter_requirement_nodes(parent.nodelist, merged, seen):
+                yield child
+            # Nodes outside of blocks in an extending template never render
+            return
+        elif isinstance(node, BlockNode):
+            chain = blocks.get(node.name, []) + [node]
+            for child in iter_requirement_nodes(chain[0].nodelist, blocks, seen, chain[1:]):
+                yield child
+        elif is_block_super(node):
+            if super_blocks:
+                for child in iter_requirement_nodes(super_blocks[0].nodelist, blocks, seen, super_blocks[1:]):
+                    yield child
+        elif hasattr(node, "template") or hasattr(node, "template_name"):
+            template = get_constant_template(node)
+            if template is not None and id(template) not in seen:
+                seen.add(id(template))
+                for child in iter_requirement_nodes(template.nodelist, {}, seen):
+                    yield child
+                seen.discard(id(template))
+        else:
+            for attr in node.child_nodelists:
+                child_nodelist = getattr(node, attr, None)
+                if child_nodelist:
+                    for child in iter_requirement_nodes(child_nodelist, blocks, seen, super_blocks):
+                        yield child
+
+def analyze_template(template_name):
+    """
+    Return the static requirements and sorted order for a template.
+
+    Requirements are returned as dictionaries in registration order.
+    """
+    from require_media.templatetags.require_media_tags import RequireInlineNode
+    template = get_template(template_name)
+    manager = RequirementManager()
+    requirements = []
+    for node in iter_requirement_nodes(template.nodelist):
+        inline = isinstance(node, RequireInlineNode)
+        priority = node.node.priority
+        if inline:
+            depends_on = list(node.depends)
+            manager.add_inline(node.requirement, None, node.group, depends_on, priority)
+        else:
+            depends_on = list(node.depends_on)
+            manager.add_external(node.requirement, node.group, depends_on, priority)
+        requirements.append({
+            "name": node.requirement,
+            "group": node.group,
+            "depends_on": depends_on,
+            "inline": inline,
+            "priority": priority,
+        })
+    order = [requirement.name for requirement in manager.get_sorted_requirements()]
+    return {"requirements": requirements, "order": order}
+
+def build_manifest(template_names=None):
+    """
+    Analyze templates and return a manifest and a list of failures.
+
+    Templates that cannot be compiled, or whose requirements form a cycle,
+    are reported as ``(name, error)`` pairs instead of being included.
+    """
+    if template_names is None:
+        template_names = find_templates()
+    templates = {}
+    errors = []
+    for name in template_names:
+        try:
+            analysis = analyze_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError, UnicodeDecodeError, CyclicDependencyError):
+            errors.append((name, sys.exc_info()[1]))
+            continue
+        if analysis["requirements"]:
+            templates[name] = analysis
+    return {"version": MANIFEST_VERSION, "templates": templates}, errors
+
+def load_manifest(path):
+    """
+    Load a manifest written by the ``requirement_manifest`` command.
+    """
+    manifest_file = open(path)
+    try:
+        manifest = json.load(manifest_file)
+    finally:
+        manifest_file.close()
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ImproperlyConfigured('Unsupported requirement manifest version in "%s"' % path)
+    return manifest
+
+def warm_sort_cache(manifest):
+    """
+    Seed the process-wide sort cache with a manifest's orderings.
+
+    Each template's requirements are replayed into a fresh manager in
+    registration order, so renders that register the same sequence find
+    their ordering already cached.
+    """
+    for analysis in manifest.get("templates", {}).values():
+        manager = RequirementManager()
+        for requirement in analysis["requirements"]:
+            priority = requirement.get("priority", 0)
+            if requirement["inline"]:
+                manager.add_inline(requirement["name"], None, requirement["group"], requirement["depends_on"], priority)
+            else:
+                manager.add_external(requirement["name"], requirement["group"], requirement["depends_on"], priority)
+        manager.get_sorted_requirements()
@@ -0,0 +1,105 @@
+"""
+Process-wide caches.
+"""
+import threading
+
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe mapping that evicts the least recently used key.
+
+    A ``max_size`` of zero or less disables the cache entirely.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Incremented by each clear, so values copied out of the cache can
+        # be checked for staleness
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        """
+        Remove every entry and reset the hit and miss counters.
+        """
+        self.lock.acquire()
+        try:
+            self.generation += 1
+            self.links = {}
+            # A circular doubly linked list of [prev, next, key, value]
+            # links, most recently used first
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self.lock.release()
+
+    def get(self, key, default=None):
+        """
+        Return the value for ``key``, marking it as recently used.
+        """
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._push(link)
+            return link[VALUE]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        """
+        Store ``value`` for ``key``, evicting the oldest entry if full.
+        """
+        if self.max_size <= 0:
+            return
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is not None:
+                link[VALUE] = value
+                self._unlink(link)
+            else:
+                link = [None, None, key, value]
+                self.links[key] = link
+                if len(self.links) > self.max_size:
+                    oldest = self.root[PREV]
+                    self._unlink(oldest)
+                    del self.links[oldest[KEY]]
+            self._push(link)
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.links),
+            "max_size": self.max_size,
+        }
+
+    def _push(self, link):
+        first = self.root[NEXT]
+        link[PREV] = self.root
+        link[NEXT] = first
+        first[PREV] = link
+        self.root[NEXT] = link
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def __len__(self):
+        return len(self.links)
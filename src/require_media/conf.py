@@ -1,6 +1,12 @@
 from django.conf import settings as project_settings
 from require_media import defaults
 
+try:
+    from django.test.signals import setting_changed
+except ImportError:
+    # Django < 1.4
+    setting_changed = None
+
 class AppSettings(object):
     """
     An app-level settings container.
@@ -27,4 +33,20 @@ class AppSettings(object):
             self.attributes[name] = val
         return val
 
+    def clear(self):
+        """
+        Forget all cached setting values.
+        """
+        self.attributes = {}
+
 settings = AppSettings(defaults, project_settings, 'REQUIRE_MEDIA')
+
+def clear_settings(sender, setting, **kwargs):
+    """
+    Reset the app-level settings when a prefixed project setting changes.
+    """
+    if setting.startswith(settings.prefix):
+        settings.clear()
+
+if setting_changed is not None:
+    setting_changed.connect(clear_settings)
@@ -1,10 +1,11 @@
 from require_media.conf import settings
+from require_media.utils import get_manager
 
 def require_media(request):
     """
     Adds the current requirements manager to context.
     """
-    manager = getattr(request, settings.REQUEST_ATTR_NAME)
+    manager = get_manager(request)
     return {
         settings.CONTEXT_VAR_NAME: manager,
     }
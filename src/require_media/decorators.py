@@ -0,0 +1,7 @@
+from django.utils.decorators import decorator_from_middleware
+
+from require_media.middleware import RequirementETagMiddleware
+
+#: Folds the digest of the request's requirements into the ETag of a
+#: view's response, as ``RequirementETagMiddleware`` does for every view
+requirement_etag = decorator_from_middleware(RequirementETagMiddleware)
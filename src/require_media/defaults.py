@@ -30,3 +30,128 @@ REQUIREMENT_ALIASES = {}
 
 #: A mapping of requirement group names to replacement names
 REQUIREMENT_GROUP_ALIASES = {}
+
+#: The maximum number of built requirement URLs to cache per process
+URL_CACHE_SIZE = 1000
+
+#: The maximum number of distinct requirement graph orderings to cache
+#: per process
+SORT_CACHE_SIZE = 100
+
+#: The maximum number of rendered requirement fragments to cache per
+#: process. Fragment caching is disabled when this is zero and no
+#: ``FRAGMENT_CACHE_BACKEND`` is configured.
+FRAGMENT_CACHE_SIZE = 0
+
+#: An optional Django cache backend (alias or URI) for sharing rendered
+#: requirement fragments between processes
+FRAGMENT_CACHE_BACKEND = None
+
+#: The prefix for keys stored in the fragment cache backend
+FRAGMENT_CACHE_KEY_PREFIX = "require_media"
+
+#: The path of a manifest written by the ``requirement_manifest`` command,
+#: used to seed the sort cache at startup
+REQUIREMENT_MANIFEST = None
+
+#: An import path to the file storage instance generated files, such as
+#: bundles, are written to. Defaults to Django's default storage.
+STORAGE = None
+
+#: The groups whose local external requirements are concatenated into
+#: bundles. Relative URLs in bundled stylesheets are made absolute, and a
+#: stylesheet using ``@import`` is only bundled at the start of a bundle.
+BUNDLE_GROUPS = []
+
+#: The storage directory bundles are written to
+BUNDLE_DIRECTORY = "require_media/bundles/"
+
+#: The maximum number of bundle URLs to cache per process
+BUNDLE_CACHE_SIZE = 1000
+
+#: An import path to a callable minifying inline JavaScript, such as
+#: ``"require_media.minifiers.minify_js"``
+JAVASCRIPT_INLINE_MINIFIER = None
+
+#: An import path to a callable minifying inline CSS, such as
+#: ``"require_media.minifiers.minify_css"``
+CSS_INLINE_MINIFIER = None
+
+#: The maximum number of minified inline blocks to cache per process
+MINIFY_CACHE_SIZE = 1000
+
+#: The length, in characters, at or above which static inline content is
+#: written to a content-hashed file and linked to instead. Blocks rendering
+#: template variables or tags, and content passed to ``add_inline`` without
+#: ``static=True``, are never promoted. Promotion is disabled when this is
+#: ``None``.
+INLINE_PROMOTION_THRESHOLD = None
+
+#: The storage directory promoted inline content is written to
+INLINE_PROMOTION_DIRECTORY = "require_media/inline/"
+
+#: The maximum number of promoted inline file URLs to cache per process
+INLINE_PROMOTION_CACHE_SIZE = 1000
+
+#: The path of a JSON manifest mapping media paths, such as
+#: ``"js/jquery.js"``, to content-hashed paths. Requirement URLs are
+#: rewritten through it. Django's ``staticfiles.json`` format, with the
+#: mapping under ``"paths"``, is also accepted; in that layout an optional
+#: ``"integrity"`` mapping of media paths to integrity values is read too.
+URL_MANIFEST = None
+
+#: The default template for external JavaScript requirements with a
+#: Subresource Integrity digest
+JAVASCRIPT_EXTERNAL_INTEGRITY_TEMPLATE = '<script src="%s" integrity="%s" crossorigin="anonymous"></script>'
+
+#: The default template for external CSS requirements with a Subresource
+#: Integrity digest
+CSS_EXTERNAL_INTEGRITY_TEMPLATE = '<link rel="stylesheet" type="text/css" href="%s" integrity="%s" crossorigin="anonymous">'
+
+#: Whether to add Subresource Integrity attributes to external requirements
+#: and bundles
+SUBRESOURCE_INTEGRITY = False
+
+#: A mapping of requirement names, such as fully qualified URLs, to pinned
+#: integrity values like ``"sha384-..."``
+INTEGRITY_HASHES = {}
+
+#: Whether to check the modification time of local files on each render,
+#: recomputing their digests when they change
+INTEGRITY_CHECK_MTIME = False
+
+#: The maximum number of integrity values to cache per process
+INTEGRITY_CACHE_SIZE = 1000
+
+#: The number of leading sorted external requirements to announce in
+#: ``Link: <url>; rel=preload`` response headers. Zero disables them.
+PRELOAD_LINK_COUNT = 0
+
+#: A mapping of group names to preload ``as`` destinations. Requirements in
+#: other groups are not preloaded.
+PRELOAD_AS = {
+    "js": "script",
+    "css": "style"
+}
+
+#: An import path to a callable accepting a request and a list of ``Link``
+#: header values, invoked before the view runs so a server can send a
+#: ``103 Early Hints`` response. The links are those sent with the previous
+#: response for the same path.
+EARLY_HINTS_HANDLER = None
+
+#: The maximum number of paths to remember preload links for
+EARLY_HINTS_CACHE_SIZE = 1000
+
+#: Whether ``render_requirements`` emits a placeholder that the middleware
+#: replaces in the finished response, rather than relying on when the
+#: template engine coerces its output
+PLACEHOLDER_MODE = False
+
+#: Whether to record requirement counts and sort and render timings for
+#: each request and send them with the ``requirements_rendered`` signal
+INSTRUMENTATION = False
+
+#: The name of a response header to report instrumentation in, such as
+#: ``"X-Require-Media-Stats"``, for debugging
+STATS_HEADER = None
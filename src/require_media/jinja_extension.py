@@ -0,0 +1,141 @@
+"""
+A Jinja2 extension providing the requirement tags.
+
+Enable it when creating the environment::
+
+    Environment(extensions=["require_media.jinja_extension.RequireMediaExtension"])
+
+The tags take the same arguments as their Django counterparts, written as
+comma separated string literals::
+
+    {% require "js", "jquery-ui.js", "jquery.js" %}
+
+    {% require_inline "sidebar", "css" %}
+    #sidebar { color: #ff0; }
+    {% end_require_inline %}
+
+    {% render_requirements "css" %}
+
+Requirements are registered with the manager in the template context, if
+any, or else the manager of the request being handled by
+``RequireMediaMiddleware``, so Django and Jinja2 templates rendered for one
+request share a manager. Jinja2 writes output as it renders, so
+``render_requirements`` always emits a placeholder, which the middleware
+replaces once every requirement is known.
+"""
+from django.template import Context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from require_media.conf import settings
+from require_media.manager import ExternalRequirement, InlineRequirement
+from require_media.renderers import precompute_url
+from require_media.utils import get_current_manager, resolve_require_arguments, resolve_require_inline_arguments
+
+class RequireMediaExtension(Extension):
+    """
+    Adds the ``require``, ``require_inline`` and ``render_requirements``
+    tags to a Jinja2 environment.
+    """
+    tags = set(["require", "require_inline", "render_requirements"])
+
+    def __init__(self, environment):
+        super(RequireMediaExtension, self).__init__(environment)
+        # Requirements built when templates are compiled, referenced from
+        # compiled code by index
+        self.requirements = []
+        self.requirement_indexes = {}
+
+    def parse(self, parser):
+        token = next(parser.stream)
+        args = self.parse_arguments(parser, token)
+        if token.value == "require":
+            return self.parse_require(parser, token, args)
+        if token.value == "require_inline":
+            return self.parse_require_inline(parser, token, args)
+        return self.parse_render_requirements(parser, token, args)
+
+    def parse_arguments(self, parser, token):
+        """
+        Parse a comma separated list of string literals.
+        """
+        args = []
+        while parser.stream.current.type != "block_end":
+            if args:
+                parser.stream.expect("comma")
+            expression = parser.parse_expression()
+            if not isinstance(expression, nodes.Const) or not isinstance(expression.value, basestring):
+                parser.fail("%s tag arguments must be string literals" % token.value, token.lineno)
+            args.append(expression.value)
+        return args
+
+    def add_requirement(self, requirement):
+        """
+        Store a compile-time requirement and return its index.
+        """
+        key = (type(requirement), requirement.name, requirement.group, requirement.depends_on,
+               requirement.priority, getattr(requirement, "static", None))
+        index = self.requirement_indexes.get(key)
+        if index is None:
+            index = len(self.requirements)
+            self.requirements.append(requirement)
+            self.requirement_indexes[key] = index
+        return index
+
+    def parse_require(self, parser, token, args):
+        try:
+            requirement, group, depends_on, priority = resolve_require_arguments(args)
+        except ValueError:
+            parser.fail("%s tag requires a requirement to be specified and an integer priority" % token.value, token.lineno)
+        node = ExternalRequirement(requirement, group, depends_on, priority)
+        precompute_url(node)
+        index = self.add_requirement(node)
+        call = self.call_method("_add_node", [nodes.ContextReference(), nodes.Const(index)])
+        return nodes.ExprStmt(call, lineno=token.lineno)
+
+    def parse_require_inline(self, parser, token, args):
+        try:
+            requirement, group, depends_on, priority = resolve_require_inline_arguments(args)
+        except ValueError:
+            parser.fail("%s tag requires two arguments, name and group, and an integer priority" % token.value, token.lineno)
+        body = parser.parse_statements(["name:end_require_inline"], drop_needle=True)
+        static = all([isinstance(node, nodes.Output) and
+                      all([isinstance(child, nodes.TemplateData) for child in node.nodes])
+                      for node in body])
+        index = self.add_requirement(InlineRequirement(requirement, None, group, depends_on, priority, static))
+        call = self.call_method("_add_inline", [nodes.ContextReference(), nodes.Const(index)])
+        return nodes.CallBlock(call, [], [], body, lineno=token.lineno)
+
+    def parse_render_requirements(self, parser, token, args):
+        groups = tuple(args or settings.GROUPS)
+        call = self.call_method("_render_requirements", [nodes.ContextReference(), nodes.Const(groups)])
+        return nodes.Output([call], lineno=token.lineno)
+
+    def get_manager(self, context):
+        manager = context.get(settings.CONTEXT_VAR_NAME)
+        if manager is None:
+            manager = get_current_manager()
+        return manager
+
+    def _add_node(self, context, index):
+        manager = self.get_manager(context)
+        if manager is not None:
+            manager.add_node(self.requirements[index])
+        return u""
+
+    def _add_inline(self, context, index, caller):
+        manager = self.get_manager(context)
+        if manager is not None:
+            prototype = self.requirements[index]
+            content = unicode(caller())
+            manager.add_node(InlineRequirement(prototype.name, content, prototype.group,
+                                               prototype.depends_on, prototype.priority, prototype.static))
+        return u""
+
+    def _render_requirements(self, context, groups):
+        manager = self.get_manager(context)
+        if manager is None:
+            return u""
+        # Django inline requirements in a mixed tree render against this
+        return Markup(manager.add_placeholder(groups, Context(context.get_all())))
@@ -0,0 +1,32 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from require_media.analysis import build_manifest, json
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('-o', '--output', default=None, dest='output',
+            help='The file to write the manifest to. Defaults to standard output.'),
+        make_option('--indent', default=None, dest='indent', type='int',
+            help='Specifies the indent level to use when pretty-printing output.'),
+    )
+    help = ("Analyze templates and output a manifest of the requirements "
+            "each one declares and their sorted order.")
+    args = '[template_name ...]'
+
+    def handle(self, *template_names, **options):
+        manifest, errors = build_manifest(template_names or None)
+        for name, error in errors:
+            sys.stderr.write("Skipped %s: %s\n" % (name, error))
+        output = json.dumps(manifest, indent=options.get('indent'), sort_keys=True)
+        path = options.get('output')
+        if path:
+            output_file = open(path, 'w')
+            try:
+                output_file.write(output)
+            finally:
+                output_file.close()
+        else:
+            self.stdout.write(output + "\n")
@@ -1,18 +1,43 @@
 """
 Classes for managing requirements.
 """
+import time
+import random
 from urlparse import urlparse
 
+from require_media.caches import LRUCache
+from require_media.conf import settings
 from require_media.utils import update_graph, topological_sort
 
+# Sorted requirement names keyed by requirement graph fingerprint
+sort_cache = LRUCache(settings.SORT_CACHE_SIZE)
+
+# A per-process token making placeholders impossible to guess
+PLACEHOLDER_NONCE = "%016x" % random.SystemRandom().getrandbits(64)
+PLACEHOLDER_TEMPLATE = "<!--require_media:" + PLACEHOLDER_NONCE + ":%d-->"
+
+# The dependencies of every requirement declared without any
+EMPTY_DEPENDENCIES = ()
+
+
 class Requirement(object):
     """
     Represents a required static resource.
+
+    Requirements are slotted, since a page may create many short-lived
+    instances. ``priority`` orders requirements not ordered by their
+    dependencies, as described for the ``require`` tag.
     """
-    def __init__(self, name, group=None, depends_on=None):
+    __slots__ = ("name", "group", "depends_on", "priority")
+
+    def __init__(self, name, group=None, depends_on=None, priority=0):
+        self.priority = priority
         self.name = name
         self.group = group
-        self.depends_on = depends_on or []
+        if depends_on:
+            self.depends_on = tuple(depends_on)
+        else:
+            self.depends_on = EMPTY_DEPENDENCIES
 
     def is_inline(self):
         """
@@ -36,22 +61,48 @@ class Requirement(object):
 class ExternalRequirement(Requirement):
     """
     A static resource linked to from a document.
+
+    ``url`` holds a ``(renderer, generation, url)`` triple when the URL has
+    been precomputed; see ``renderers.precompute_url``.
     """
-    pass
+    __slots__ = ("url",)
+
+    def __init__(self, name, group=None, depends_on=None, priority=0):
+        self.url = None
+        super(ExternalRequirement, self).__init__(name, group, depends_on, priority)
 
 
 class InlineRequirement(Requirement):
     """
     A static resource defined within a document.
+
+    ``static`` is true when the content is known to be the same on every
+    render, making it safe to write to public storage. Only the template
+    tags can prove that, so it defaults to false.
     """
-    def __init__(self, name, content, group=None, depends_on=None):
+    __slots__ = ("content", "static")
+
+    def __init__(self, name, content, group=None, depends_on=None, priority=0, static=False):
         self.content = content
-        super(InlineRequirement, self).__init__(name, group, depends_on)
+        self.static = static
+        super(InlineRequirement, self).__init__(name, group, depends_on, priority)
 
     def is_inline(self):
         return True
 
 
+class RequirementStats(object):
+    """
+    Time, in seconds, spent on a manager's requirements.
+
+    ``render_time`` includes ``inline_time``.
+    """
+    def __init__(self):
+        self.sort_time = 0.0
+        self.inline_time = 0.0
+        self.render_time = 0.0
+
+
 class RequirementManager(object):
     """
     A registry of static resources the response to a request may depend upon.
@@ -60,44 +111,175 @@ class RequirementManager(object):
         self.requirements = []
         self.requirements_map = {}
         self.graph = {}
+        # Node names in order of first appearance, and the priorities of
+        # registered nodes other than zero, which break ties when sorting
+        self.sequence = {}
+        self.priorities = {}
+        self.max_priority = 0
+        # The maintained topological order of node names and their indexes,
+        # established by the first read
+        self.order = None
+        self.positions = None
         self.sorted = None
+        # A running hash of every registration, used to key the sort cache
+        self.fingerprint = 0
+        # When streaming, requirements are rendered at most once each
+        self.streaming = False
+        self.rendered = set()
+        # (groups, context) pairs for placeholders awaiting substitution
+        self.placeholders = []
+        # The sorted requirements the digest was last computed for, and it
+        self.digest = (None, None)
+        self.stats = None
+        if settings.INSTRUMENTATION:
+            self.stats = RequirementStats()
 
-    def add_external(self, name, group=None, depends_on=None):
+    def add_external(self, name, group=None, depends_on=None, priority=0):
         """
         Register an external (linked) requirement with the manager.
         """
-        node = ExternalRequirement(name, group, depends_on)
+        node = ExternalRequirement(name, group, depends_on, priority)
         self.add_node(node)
         
-    def add_inline(self, name, content, group=None, depends_on=None):
+    def add_inline(self, name, content, group=None, depends_on=None, priority=0, static=False):
         """
         Register an inline dependency with the manager.
+
+        Pass ``static=True`` only for content that never varies between
+        requests; such content may be promoted to a public file.
         """
-        node = InlineRequirement(name, content, group, depends_on)
+        node = InlineRequirement(name, content, group, depends_on, priority, static)
         self.add_node(node)
 
     def add_node(self, node):
         """
         Update the registry.
+
+        Nodes may be shared between managers, as the template tags' are, so
+        they are never modified here. Nodes are unique by name. Registering
+        a name again keeps the first node, and its priority, and merges any
+        new dependencies into its arcs in the graph.
         """
-        # Clear the cache
-        self.sorted = None
-        self.requirements.append(node)
-        self.requirements_map[node.name] = node
-        # Update graph
-        update_graph(self.graph, node.name, node.depends_on)
+        self.add_many((node,))
+
+    def add_many(self, nodes):
+        """
+        Register a sequence of nodes, invalidating the sorted requirements
+        at most once.
+
+        The result is the same as calling ``add_node`` for each in turn.
+        """
+        requirements_map = self.requirements_map
+        sequence = self.sequence
+        fingerprint = self.fingerprint
+        changed = False
+        for node in nodes:
+            name = node.name
+            known = name in sequence
+            if not known:
+                sequence[name] = len(sequence)
+            for dependency in node.depends_on:
+                if dependency not in sequence:
+                    sequence[dependency] = len(sequence)
+            is_new = name not in requirements_map
+            priority = 0
+            if is_new:
+                self.requirements.append(node)
+                requirements_map[name] = node
+                priority = node.priority
+                if priority:
+                    self.priorities[name] = priority
+                    if priority > self.max_priority:
+                        self.max_priority = priority
+            # Update graph
+            added = update_graph(self.graph, name, node.depends_on)
+            if not is_new and not added:
+                continue
+            changed = True
+            fingerprint = hash((fingerprint, name, priority, tuple(added)))
+            if self.order is not None:
+                self.update_order(name, added, known, priority)
+        if changed:
+            # Clear the cache
+            self.sorted = None
+            self.fingerprint = fingerprint
+
+    def get_dependencies(self, name):
+        """
+        Return the merged set of dependency names for a requirement.
+        """
+        if name in self.graph:
+            return self.graph[name][1]
+        return set()
+
+    def sort_key(self, name):
+        """
+        Order nodes by priority, then by first appearance.
+        """
+        return (self.priorities.get(name, 0), self.sequence[name])
+
+    def update_order(self, name, dependencies, known, priority):
+        """
+        Fit a newly registered node into the maintained order.
+
+        A node new to the graph, with a priority no lower than any other,
+        sorts after every placed node, so it is appended. Its dependencies
+        new to the graph have priority zero, so they are only appended when
+        no placed node has a higher priority. Any other change may move
+        placed nodes, so the order is discarded and the graph sorted again
+        when next read.
+        """
+        positions = self.positions
+        if not known and priority >= self.max_priority and name not in dependencies:
+            new = [dependency for dependency in dependencies if dependency not in positions]
+            if not new or self.max_priority <= 0:
+                for dependency in new:
+                    self._append(dependency)
+                self._append(name)
+                return
+        elif known and not dependencies and not priority:
+            return
+        self.order = None
+        self.positions = None
+
+    def _append(self, name):
+        self.positions[name] = len(self.order)
+        self.order.append(name)
 
     def get_sorted_requirements(self):
         """
         Return the requirements in topological order.
+
+        Each position is taken by the requirement with the lowest priority,
+        then the earliest first appearance, among those whose dependencies
+        have all been placed, so the same sequence of registrations always
+        gives the same order. Raises ``CyclicDependencyError`` if the
+        dependencies form a cycle.
+
+        The first call sorts the graph, sharing orderings between managers
+        built from the same sequence of registrations. The order is then
+        maintained incrementally where requirements are only appended.
         """
         if self.sorted is None:
-            ordered = topological_sort(self.graph)
-            if ordered:
-                ordered = [self.requirements_map[name] for name in reversed(ordered)]
-                self.sorted = ordered
-            else:
-                return self.requirements
+            if self.order is None:
+                key = (self.fingerprint, len(self.graph))
+                ordered = sort_cache.get(key)
+                if ordered is None:
+                    if self.stats is not None:
+                        start = time.time()
+                        ordered = topological_sort(self.graph, self.sort_key)
+                        self.stats.sort_time += time.time() - start
+                    else:
+                        ordered = topological_sort(self.graph, self.sort_key)
+                    if not ordered:
+                        return self.requirements
+                    ordered.reverse()
+                    ordered = tuple(ordered)
+                    sort_cache.set(key, ordered)
+                self.order = list(ordered)
+                self.positions = dict([(name, index) for index, name in enumerate(ordered)])
+            requirements_map = self.requirements_map
+            self.sorted = [requirements_map[name] for name in self.order if name in requirements_map]
         return self.sorted
 
     def get_sorted_requirements_for_groups(self, *groups):
@@ -111,3 +293,77 @@ class RequirementManager(object):
             if requirement.group in group_set:
                 filtered.append(requirement)
         return filtered
+
+    def get_pending_requirements_for_groups(self, groups, final=False):
+        """
+        Return the unrendered requirements for the given groups in
+        topological order.
+
+        Unless ``final`` is true, requirements depending on names that have
+        not been registered yet are held back, since the missing
+        requirements must be rendered first.
+        """
+        group_set = set(groups)
+        rendered = self.rendered
+        ready = set(rendered)
+        pending = []
+        for requirement in self.get_sorted_requirements():
+            name = requirement.name
+            if not final:
+                for dependency in self.get_dependencies(name):
+                    if dependency not in ready:
+                        break
+                else:
+                    ready.add(name)
+                if name not in ready:
+                    continue
+            if name not in rendered and requirement.group in group_set:
+                pending.append(requirement)
+        return pending
+
+    def mark_rendered(self, requirements):
+        """
+        Record that the given requirements have been rendered.
+        """
+        for requirement in requirements:
+            self.rendered.add(requirement.name)
+
+    def add_placeholder(self, groups, context):
+        """
+        Register a placeholder for the given groups and return its text.
+        """
+        self.placeholders.append((groups, context))
+        return PLACEHOLDER_TEMPLATE % (len(self.placeholders) - 1)
+
+    def get_digest(self):
+        """
+        Return a hex digest of the sorted requirements and the versions of
+        their assets, where known, for use in ETags.
+
+        The digest depends only on the requirements' names, groups, order,
+        URLs and known integrity values, so it is the same in every process
+        serving the same assets.
+        """
+        requirements = self.get_sorted_requirements()
+        if self.digest[0] is not requirements:
+            from require_media.renderers import requirements_digest
+            self.digest = (requirements, requirements_digest(requirements))
+        return self.digest[1]
+
+    def get_stats(self):
+        """
+        Return a dictionary of requirement counts and timings, or ``None``
+        if instrumentation is disabled.
+        """
+        if self.stats is None:
+            return None
+        groups = {}
+        for requirement in self.requirements:
+            groups[requirement.group] = groups.get(requirement.group, 0) + 1
+        return {
+            "count": len(self.requirements),
+            "groups": groups,
+            "sort_time": self.stats.sort_time,
+            "inline_time": self.stats.inline_time,
+            "render_time": self.stats.render_time,
+        }
@@ -1,11 +1,163 @@
-from require_media.manager import RequirementManager
+import hashlib
+
+from django.conf import settings as project_settings
+
+from require_media.caches import LRUCache
+from require_media.renderers import renderer_registry, url_manifest, build_preload_links, replace_placeholders
 from require_media.conf import settings
+from require_media.signals import requirements_rendered
+from require_media.utils import current_request
 
 class RequireMediaMiddleware(object):
     """
-    Adds a dependency manager to the request for later use.
+    Post-processes responses using the request's dependency manager.
+
+    The manager itself is created lazily by ``utils.get_manager``. While a
+    request is handled it is made current, so code without access to it
+    can find its manager with ``utils.get_current_manager``.
+
+    The middleware may be listed in ``MIDDLEWARE_CLASSES``, or be called
+    with ``get_response`` in the style of newer handlers.
     """
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        # Resolve renderers up front so bad paths fail at startup
+        renderer_registry.populate()
+        url_manifest.load()
+        if settings.REQUIREMENT_MANIFEST:
+            from require_media.analysis import load_manifest, warm_sort_cache
+            warm_sort_cache(load_manifest(settings.REQUIREMENT_MANIFEST))
+        self.early_hints_handler = None
+        if settings.EARLY_HINTS_HANDLER:
+            from require_media.utils import get_module_attribute
+            self.early_hints_handler = get_module_attribute(settings.EARLY_HINTS_HANDLER)
+        # Preload links sent with the last response for each path
+        self.early_hints = LRUCache(settings.EARLY_HINTS_CACHE_SIZE)
+
+    def __call__(self, request):
+        token = current_request.set(request)
+        try:
+            self.send_early_hints(request)
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.process_response(request, response)
+
     def process_request(self, request):
-        manager = RequirementManager()
-        setattr(request, settings.REQUEST_ATTR_NAME, manager)
+        request.require_media_scope_token = current_request.set(request)
+        self.send_early_hints(request)
         return None
+
+    def send_early_hints(self, request):
+        if self.early_hints_handler is not None:
+            links = self.early_hints.get(request.path)
+            if links:
+                self.early_hints_handler(request, links)
+
+    def process_response(self, request, response):
+        if hasattr(request, "require_media_scope_token"):
+            token = request.require_media_scope_token
+            del request.require_media_scope_token
+            current_request.reset(token)
+        manager = getattr(request, settings.REQUEST_ATTR_NAME, None)
+        if manager is None:
+            return response
+        substitute_placeholders(manager, response)
+        if manager.stats is not None:
+            self.report_stats(request, response, manager)
+        limit = settings.PRELOAD_LINK_COUNT
+        if not limit or not manager.requirements:
+            return response
+        links = build_preload_links(manager.get_sorted_requirements(), limit)
+        if links:
+            header = ", ".join(links)
+            if response.has_header("Link"):
+                header = "%s, %s" % (response["Link"], header)
+            response["Link"] = header
+            if self.early_hints_handler is not None and response.status_code == 200:
+                self.early_hints.set(request.path, links)
+        return response
+
+    def report_stats(self, request, response, manager):
+        """
+        Send the manager's instrumentation with ``requirements_rendered``
+        and, if ``STATS_HEADER`` is set, in a response header.
+
+        Rendering that happens while a streaming response is consumed is
+        not included.
+        """
+        stats = manager.get_stats()
+        requirements_rendered.send(sender=self.__class__, request=request, stats=stats)
+        if settings.STATS_HEADER:
+            groups = ", ".join(["%s=%d" % item for item in sorted(stats["groups"].items())])
+            response[settings.STATS_HEADER] = "count=%d; groups=%s; sort=%.6f; inline=%.6f; render=%.6f" % (
+                stats["count"], groups, stats["sort_time"], stats["inline_time"], stats["render_time"])
+
+
+class RequirementETagMiddleware(object):
+    """
+    Folds the digest of the request's requirements into the response ETag,
+    and answers conditional GETs matching the result with 304 Not Modified.
+
+    Responses without an ETag are given one from their content. Because
+    the digest includes asset versions where they are known, a changed
+    asset changes the ETag even when the page content does not. List this
+    middleware before ``RequireMediaMiddleware`` and any middleware setting
+    ETags, so it sees their responses.
+
+    Like ``RequireMediaMiddleware``, it may be listed in
+    ``MIDDLEWARE_CLASSES`` or be called with ``get_response``.
+    """
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.process_response(request, self.get_response(request))
+
+    def process_response(self, request, response):
+        manager = getattr(request, settings.REQUEST_ATTR_NAME, None)
+        if manager is None or response.status_code != 200 or request.method not in ("GET", "HEAD"):
+            return response
+        if not response.has_header("ETag"):
+            if is_streaming(response):
+                return response
+            substitute_placeholders(manager, response)
+            base = hashlib.md5(response.content).hexdigest()
+        else:
+            base = response["ETag"]
+        etag = '"%s"' % hashlib.md5(base + manager.get_digest()).hexdigest()
+        response["ETag"] = etag
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            if etag in tags or "*" in tags:
+                # Keep the response's headers, such as Cache-Control and
+                # Vary, which a 304 must carry too
+                response.status_code = 304
+                if getattr(response, "streaming", False):
+                    response.streaming_content = []
+                else:
+                    response.content = ""
+                if response.has_header("Content-Length"):
+                    del response["Content-Length"]
+        return response
+
+
+def substitute_placeholders(manager, response):
+    """
+    Replace the manager's placeholders in a response's content, unless the
+    content is streamed.
+    """
+    if manager.placeholders and not is_streaming(response):
+        charset = getattr(response, "_charset", project_settings.DEFAULT_CHARSET)
+        response.content = replace_placeholders(manager, response.content, charset)
+        manager.placeholders = []
+        if response.has_header("Content-Length"):
+            response["Content-Length"] = str(len(response.content))
+
+
+def is_streaming(response):
+    """
+    Is the response content an iterator that must not be consumed?
+    """
+    return getattr(response, "streaming", False) or not getattr(response, "_is_string", True)
@@ -0,0 +1,129 @@
+"""
+Conservative minifiers for inline CSS and JavaScript.
+
+These only remove comments and redundant whitespace; string literals (and,
+for JavaScript, regular expression literals) are copied verbatim.
+"""
+import re
+
+CSS_TOKENS = re.compile(r"""
+    ("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')   # strings
+  | (/\*.*?\*/)                             # comments
+  | (\s*;\s*(?=}))                          # final semicolons
+  | (\s*([{};,>])\s*)                       # punctuation
+  | (\s+)                                   # whitespace
+""", re.S | re.X)
+
+def minify_css(content):
+    """
+    Strip comments and redundant whitespace from CSS.
+    """
+    def replace(match):
+        string, comment, semicolon, punctuation, character, space = match.groups()
+        if string:
+            return string
+        if comment or semicolon:
+            return u""
+        if punctuation:
+            return character
+        return u" "
+    return CSS_TOKENS.sub(replace, content).strip()
+
+# Characters after which a slash starts a regular expression literal
+REGEX_PREFIXES = set(u"(,=:[!&|?{};+-*%<>~^")
+
+# Keywords after which a slash starts a regular expression literal
+REGEX_KEYWORDS = set([u"return", u"typeof", u"case", u"do", u"else", u"in",
+                      u"instanceof", u"new", u"delete", u"void", u"throw"])
+
+# Characters a space next to may be dropped
+SPACE_OPTIONAL = set(u"{}()[];,=:<>!&|?")
+
+# Characters a following newline may be dropped after
+NEWLINE_OPTIONAL = set(u"{;,")
+
+def is_word_character(character):
+    return bool(character) and (character.isalnum() or character in u"_$")
+
+def minify_js(content):
+    """
+    Strip comments and redundant whitespace from JavaScript.
+
+    Line breaks that may be significant to automatic semicolon insertion
+    are kept.
+    """
+    output = []
+    pending = None
+    previous = u""
+    word = u""
+    position, length = 0, len(content)
+
+    def emit(token):
+        if pending and output:
+            keep_space = not (previous in SPACE_OPTIONAL or token[0] in SPACE_OPTIONAL)
+            if pending == u"\n" and previous not in NEWLINE_OPTIONAL:
+                output.append(u"\n")
+            elif pending == u" " and keep_space:
+                output.append(u" ")
+            elif pending == u"\n" and keep_space:
+                output.append(u" ")
+        output.append(token)
+
+    while position < length:
+        character = content[position]
+        if character.isspace():
+            if character == u"\n" or pending == u"\n":
+                pending = u"\n"
+            else:
+                pending = u" "
+            position += 1
+            continue
+        if content.startswith(u"/*", position):
+            end = content.find(u"*/", position + 2)
+            end = length if end == -1 else end + 2
+            if u"\n" in content[position:end]:
+                pending = u"\n"
+            elif pending is None:
+                pending = u" "
+            position = end
+            continue
+        if content.startswith(u"//", position):
+            end = content.find(u"\n", position)
+            position = length if end == -1 else end
+            continue
+        if character in u"'\"`":
+            end = position + 1
+            while end < length and content[end] != character:
+                if content[end] == u"\\":
+                    end += 1
+                end += 1
+            token = content[position:end + 1]
+        elif character == u"/" and (not previous or previous in REGEX_PREFIXES or word in REGEX_KEYWORDS):
+            end = position + 1
+            in_class = False
+            while end < length and content[end] != u"\n":
+                if content[end] == u"\\":
+                    end += 2
+                    continue
+                if content[end] == u"[":
+                    in_class = True
+                elif content[end] == u"]":
+                    in_class = False
+                elif content[end] == u"/" and not in_class:
+                    break
+                end += 1
+            token = content[position:end + 1]
+        else:
+            token = character
+        if len(token) == 1 and is_word_character(token):
+            if pending is None and is_word_character(previous):
+                word += token
+            else:
+                word = token
+        else:
+            word = u""
+        emit(token)
+        pending = None
+        position += len(token)
+        previous = token[-1]
+    return u"".join(output)
@@ -1,24 +1,268 @@
-from urlparse import urljoin
+import os
+import re
+import sys
+import time
+import base64
+import hashlib
+from urlparse import urljoin, urlparse
 
 from django.conf import settings as project_settings
+from django.core.exceptions import ImproperlyConfigured
 from require_media.conf import settings
+from require_media.caches import LRUCache
 
 MEDIA_URL = project_settings.MEDIA_URL
+MEDIA_ROOT = project_settings.MEDIA_ROOT
+
+# Built URLs keyed by (renderer, requirement name)
+url_cache = LRUCache(settings.URL_CACHE_SIZE)
+
+# (bundle URL, integrity value) keyed by (renderer, tuple of requirement
+# names, tuple of their integrity values if Subresource Integrity is on)
+bundle_cache = LRUCache(settings.BUNDLE_CACHE_SIZE)
+
+# Minified inline content keyed by (minifier path, content digest)
+minify_cache = LRUCache(settings.MINIFY_CACHE_SIZE)
+
+# Promoted inline file (URL, integrity value) pairs keyed by (renderer,
+# content digest)
+promotion_cache = LRUCache(settings.INLINE_PROMOTION_CACHE_SIZE)
+
+# (local path or None, modification time, integrity value) keyed by
+# (renderer, requirement name, URL manifest version)
+integrity_cache = LRUCache(settings.INTEGRITY_CACHE_SIZE)
+
+
+class URLManifest(object):
+    """
+    A mapping of media paths to content-hashed paths, loaded once.
+
+    The ``version`` is a digest of the manifest file, or ``None`` when no
+    manifest is configured.
+    """
+    def __init__(self):
+        self.path = None
+        self.paths = {}
+        self.integrity = {}
+        self.version = None
+        self.loaded = False
+
+    def load(self):
+        """
+        Load the manifest named by the ``URL_MANIFEST`` setting.
+        """
+        try:
+            import json
+        except ImportError:
+            from django.utils import simplejson as json
+        path = settings.URL_MANIFEST
+        paths, integrity, version = {}, {}, None
+        if path:
+            try:
+                manifest_file = open(path, "rb")
+                try:
+                    content = manifest_file.read()
+                finally:
+                    manifest_file.close()
+                manifest = json.loads(content.decode("utf-8"))
+            except (IOError, ValueError):
+                error = sys.exc_info()[1]
+                raise ImproperlyConfigured('Error loading URL manifest "%s": %s' % (path, error))
+            if "paths" in manifest:
+                paths = manifest["paths"]
+                integrity = manifest.get("integrity", {})
+            else:
+                paths = manifest
+            version = hashlib.md5(content).hexdigest()
+        self.path, self.paths, self.integrity, self.version = path, paths, integrity, version
+        self.loaded = True
+        url_cache.clear()
+
+    def get(self, path):
+        """
+        Return the hashed path for a media path, or ``None``.
+        """
+        if not self.loaded or self.path != settings.URL_MANIFEST:
+            self.load()
+        return self.paths.get(path)
+
+    def get_integrity(self, path):
+        """
+        Return the integrity value recorded for a media path, or ``None``.
+        """
+        if not self.loaded or self.path != settings.URL_MANIFEST:
+            self.load()
+        return self.integrity.get(path)
+
+# The process-wide URL manifest
+url_manifest = URLManifest()
+
+
+def compute_integrity(path):
+    """
+    Compute the ``sha384`` Subresource Integrity value of a file.
+    """
+    digest = hashlib.sha384()
+    media_file = open(path, "rb")
+    try:
+        for chunk in iter(lambda: media_file.read(65536), ""):
+            digest.update(chunk)
+    finally:
+        media_file.close()
+    return "sha384-" + base64.b64encode(digest.digest())
+
+
+def content_integrity(content):
+    """
+    Compute the ``sha384`` Subresource Integrity value of content, encoded
+    as UTF-8 if it is text.
+    """
+    if isinstance(content, unicode):
+        content = content.encode("utf-8")
+    return "sha384-" + base64.b64encode(hashlib.sha384(content).digest())
+
+
+def content_digest(content):
+    """
+    Return a binary digest of text content.
+    """
+    if isinstance(content, unicode):
+        content = content.encode("utf-8")
+    return hashlib.sha1(content).digest()
+
+
+css_charset_re = re.compile(r'^(?:\xef\xbb\xbf)?@charset\s+"[^"]*";\s*')
+css_import_re = re.compile(r"@import\b", re.I)
+css_url_re = re.compile(r"""(url\(\s*(['"]?))([^'")\s]+)(\2\s*\))|(@import\s+(['"]))([^'"]+)(\6)""", re.I)
+
+def rewrite_css_urls(content, base):
+    """
+    Make the relative ``url()`` and ``@import`` references of a stylesheet
+    absolute, resolving them against the stylesheet's URL.
+    """
+    def rewrite(match):
+        if match.group(1):
+            prefix, url, suffix = match.group(1, 3, 4)
+        else:
+            prefix, url, suffix = match.group(5, 7, 8)
+        parsed = urlparse(url)
+        if parsed.scheme or parsed.netloc or url.startswith(("/", "#")):
+            return match.group(0)
+        return prefix + urljoin(base, url) + suffix
+    return css_url_re.sub(rewrite, content)
 
 
 class RequirementRenderer(object):
     """
     A base class for rendering media requirements.
     """
+    inline_minifier = None
+
     def build_url(self, requirement):
         """
-        Build the URL for a given requirement.
+        Build the URL for a given requirement, consulting the URL cache.
+
+        A URL precomputed on the requirement is used while the URL cache
+        has not been cleared since, and refreshed otherwise.
+        """
+        precomputed = getattr(requirement, "url", None)
+        if precomputed is not None:
+            renderer, generation, url = precomputed
+            if renderer is self and generation == url_cache.generation:
+                return url
+        key = (self, requirement.name)
+        url = url_cache.get(key)
+        if url is None:
+            url = self.resolve_url(requirement)
+            url_cache.set(key, url)
+        if precomputed is not None:
+            requirement.url = (self, url_cache.generation, url)
+        return url
+
+    def resolve_url(self, requirement):
+        """
+        Compute the URL for a given requirement.
         """
         if requirement.is_qualified_url():
             return requirement.name
+        hashed = url_manifest.get(self.directory + requirement.name)
+        if hashed is not None:
+            return urljoin(MEDIA_URL, hashed)
         path = urljoin(MEDIA_URL, self.directory)
         return urljoin(path, requirement.name)
 
+    def build_path(self, requirement):
+        """
+        Build the local filesystem path for a given requirement.
+        """
+        return os.path.join(MEDIA_ROOT, self.directory, requirement.name)
+
+    def can_bundle(self, requirement):
+        """
+        Can the requirement be concatenated into a bundle?
+        """
+        return not requirement.is_inline() and not requirement.is_qualified_url()
+
+    def build_bundle(self, requirements):
+        """
+        Get the URL and integrity value of the bundle for an ordered list of
+        requirements.
+
+        The bundle is written on first use and named by its content hash.
+        With Subresource Integrity enabled, it is rebuilt whenever the
+        integrity value of one of the requirements changes.
+        """
+        from require_media.storage import save_hashed
+        names = tuple([requirement.name for requirement in requirements])
+        if settings.SUBRESOURCE_INTEGRITY:
+            key = (self, names, url_manifest.version, tuple([self.get_integrity(requirement) for requirement in requirements]))
+        else:
+            key = (self, names, url_manifest.version, None)
+        bundle = bundle_cache.get(key)
+        if bundle is None:
+            parts = []
+            for requirement in requirements:
+                source = open(self.build_path(requirement), "rb")
+                try:
+                    parts.append(source.read())
+                finally:
+                    source.close()
+            content = self.join_bundle(requirements, parts)
+            url = save_hashed(settings.BUNDLE_DIRECTORY, content, self.extension)
+            bundle = (url, content_integrity(content))
+            bundle_cache.set(key, bundle)
+        return bundle
+
+    def join_bundle(self, requirements, parts):
+        """
+        Join the file contents of an ordered list of requirements into the
+        content of their bundle.
+
+        Raises ``ValueError`` if the files cannot be bundled.
+        """
+        return self.bundle_separator.join(parts)
+
+    def build_bundle_url(self, requirements):
+        """
+        Get the URL of the bundle for an ordered list of requirements.
+        """
+        return self.build_bundle(requirements)[0]
+
+    def render_bundle(self, requirements, context):
+        """
+        Render an ordered list of local external requirements as one bundle.
+
+        Falls back to rendering each requirement if a file cannot be read
+        or the files cannot be bundled.
+        """
+        try:
+            url, integrity = self.build_bundle(requirements)
+        except (IOError, OSError, ValueError):
+            return u"".join([self.render(requirement, context) for requirement in requirements])
+        if settings.SUBRESOURCE_INTEGRITY:
+            return self.external_integrity_template % (url, integrity)
+        return self.external_template % url
+
     def render(self, requirement, context):
         """
         Render a given requirement.
@@ -35,20 +279,107 @@ class RequirementRenderer(object):
         content = requirement.content
         if hasattr(content, "render"):
             content = content.render(context) 
+        if self.inline_minifier:
+            content = self.minify(content)
+        threshold = settings.INLINE_PROMOTION_THRESHOLD
+        if threshold is not None and requirement.static and len(content) >= threshold:
+            url, integrity = self.promote(content)
+            if settings.SUBRESOURCE_INTEGRITY:
+                return self.external_integrity_template % (url, integrity)
+            return self.external_template % url
         return self.inline_template % content
 
+    def minify(self, content):
+        """
+        Minify inline content, memoized by a digest of the content.
+        """
+        key = (self.inline_minifier, content_digest(content))
+        minified = minify_cache.get(key)
+        if minified is None:
+            from require_media.utils import get_module_attribute
+            minifier = get_module_attribute(self.inline_minifier)
+            minified = minifier(content)
+            minify_cache.set(key, minified)
+        return minified
+
+    def promote(self, content):
+        """
+        Write inline content to a content-hashed file and return its URL and
+        integrity value.
+
+        Each distinct body is written once. Only static blocks are promoted,
+        since the files are public and never removed.
+        """
+        from require_media.storage import save_hashed
+        key = (self, content_digest(content))
+        promoted = promotion_cache.get(key)
+        if promoted is None:
+            url = save_hashed(settings.INLINE_PROMOTION_DIRECTORY, content, self.extension)
+            promoted = (url, content_integrity(content))
+            promotion_cache.set(key, promoted)
+        return promoted
+
     def render_external(self, requirement, context):
         """
         Internal method to render an external requirement.
         """
         url = self.build_url(requirement)
+        if settings.SUBRESOURCE_INTEGRITY:
+            integrity = self.get_integrity(requirement)
+            if integrity:
+                return self.external_integrity_template % (url, integrity)
         return self.external_template % url
 
+    def get_local_path(self, requirement):
+        """
+        Get the path of the file served for a local requirement.
+        """
+        hashed = url_manifest.get(self.directory + requirement.name)
+        if hashed is not None:
+            return os.path.join(MEDIA_ROOT, hashed)
+        return self.build_path(requirement)
+
+    def get_integrity(self, requirement):
+        """
+        Get the Subresource Integrity value for an external requirement.
+
+        Values come from ``INTEGRITY_HASHES``, the URL manifest, or a digest
+        of the local file computed once and cached. Unpinned qualified URLs
+        have no value.
+        """
+        key = (self, requirement.name, url_manifest.version)
+        entry = integrity_cache.get(key)
+        if entry is not None:
+            path, mtime, integrity = entry
+            if path is None or not settings.INTEGRITY_CHECK_MTIME:
+                return integrity
+            try:
+                if os.stat(path).st_mtime == mtime:
+                    return integrity
+            except OSError:
+                pass
+        path, mtime, integrity = None, None, settings.INTEGRITY_HASHES.get(requirement.name)
+        if integrity is None and not requirement.is_qualified_url():
+            integrity = url_manifest.get_integrity(self.directory + requirement.name)
+            if integrity is None:
+                path = self.get_local_path(requirement)
+                try:
+                    mtime = os.stat(path).st_mtime
+                    integrity = compute_integrity(path)
+                except (IOError, OSError):
+                    path = None
+        integrity_cache.set(key, (path, mtime, integrity))
+        return integrity
+
 
 class JavaScriptRequirementRenderer(RequirementRenderer):
     directory = "js/"
+    extension = "js"
+    bundle_separator = "\n;\n"
     external_template = settings.JAVASCRIPT_EXTERNAL_TEMPLATE
+    external_integrity_template = settings.JAVASCRIPT_EXTERNAL_INTEGRITY_TEMPLATE
     inline_template = settings.JAVASCRIPT_INLINE_TEMPLATE
+    inline_minifier = settings.JAVASCRIPT_INLINE_MINIFIER
 
 # An instance of the JavaScript requirement renderer for convenience
 javascript_requirement_renderer = JavaScriptRequirementRenderer()
@@ -56,22 +387,348 @@ javascript_requirement_renderer = JavaScriptRequirementRenderer()
 
 class CSSRequirementRenderer(RequirementRenderer):
     directory = "css/"
+    extension = "css"
+    bundle_separator = "\n"
     external_template = settings.CSS_EXTERNAL_TEMPLATE
+    external_integrity_template = settings.CSS_EXTERNAL_INTEGRITY_TEMPLATE
     inline_template = settings.CSS_INLINE_TEMPLATE
+    inline_minifier = settings.CSS_INLINE_MINIFIER
+
+    def join_bundle(self, requirements, parts):
+        """
+        Join stylesheets, rewriting their relative URLs against their own
+        URLs, since the bundle is served from another directory.
+
+        The first ``@charset`` rule is hoisted to the start of the bundle and
+        the others dropped. ``@import`` rules must precede all other rules,
+        so a stylesheet using them can only be bundled first.
+        """
+        charset = None
+        rewritten = []
+        for requirement, content in zip(requirements, parts):
+            match = css_charset_re.match(content)
+            if match:
+                if charset is None:
+                    charset = match.group(0).strip()
+                content = content[match.end():]
+            if rewritten and css_import_re.search(content):
+                raise ValueError("%s uses @import and cannot be bundled after other stylesheets" % requirement.name)
+            base = self.build_url(requirement)
+            if isinstance(base, unicode):
+                base = base.encode("utf-8")
+            rewritten.append(rewrite_css_urls(content, base))
+        content = self.bundle_separator.join(rewritten)
+        if charset is not None:
+            content = charset + self.bundle_separator + content
+        return content
 
 # An instance of the CSS requirement renderer for convenience
 css_requirement_renderer = CSSRequirementRenderer()
 
 
-def get_renderer(group):
+def load_renderer(path):
     """
-    Get a renderer instance for the given group name.
+    Import the renderer instance named by the given path.
     """
     from require_media.utils import get_module_attribute
     try:
-        renderer_path = settings.RENDERERS[group]
-        renderer = get_module_attribute(renderer_path)
-        return renderer
-    except (KeyError, ImportError, AttributeError):
-        return None
+        renderer = get_module_attribute(path)
+    except (ImportError, AttributeError):
+        error = sys.exc_info()[1]
+        raise ImproperlyConfigured('Error loading requirement renderer "%s": %s' % (path, error))
+    if renderer is None:
+        raise ImproperlyConfigured('"%s" does not name a requirement renderer' % path)
+    return renderer
+
+
+class RendererRegistry(object):
+    """
+    A mapping of group names to renderer instances, resolved once.
+
+    The registry is rebuilt whenever the ``RENDERERS`` setting is replaced.
+    """
+    def __init__(self):
+        self.paths = None
+        self.renderers = {}
+
+    def populate(self):
+        """
+        Resolve the renderer for every configured group.
+
+        Raises ``ImproperlyConfigured`` if any renderer path is invalid.
+        """
+        paths = settings.RENDERERS
+        renderers = {}
+        for group, path in paths.items():
+            renderers[group] = load_renderer(path)
+        self.renderers = renderers
+        self.paths = paths
+
+    def clear(self):
+        """
+        Forget all resolved renderers.
+        """
+        self.paths = None
+        self.renderers = {}
+
+    def get(self, group):
+        """
+        Get the renderer for the given group, or ``None`` if there is none.
+        """
+        if self.paths is not settings.RENDERERS:
+            self.populate()
+        return self.renderers.get(group)
+
+# The process-wide renderer registry
+renderer_registry = RendererRegistry()
+
+
+def get_renderer(group):
+    """
+    Get a renderer instance for the given group name.
+    """
+    return renderer_registry.get(group)
+
+
+def precompute_url(requirement):
+    """
+    Store the URL of a long-lived external requirement on it.
+
+    Requirements without a renderer are left alone, to fail at render
+    time as they otherwise would.
+    """
+    renderer = get_renderer(requirement.group)
+    if renderer is not None:
+        url = renderer.build_url(requirement)
+        requirement.url = (renderer, url_cache.generation, url)
+
+
+class FragmentCache(object):
+    """
+    A cache of rendered output for runs of external requirements.
+
+    Entries are kept in a process-wide LRU and, if a Django cache backend
+    is given, shared through it. Rendering external requirements is assumed
+    to be independent of the template context.
+    """
+    def __init__(self, max_size=0, backend=None, key_prefix=""):
+        self.local = LRUCache(max_size)
+        self.backend = backend
+        self.key_prefix = key_prefix
+
+    def get_backend(self):
+        if isinstance(self.backend, basestring):
+            from django.core.cache import get_cache
+            self.backend = get_cache(self.backend)
+        return self.backend
+
+    def is_enabled(self):
+        return self.local.max_size > 0 or self.backend is not None
+
+    def make_key(self, requirements):
+        """
+        Build a cache key from the digest of an ordered requirement list
+        and the URL manifest version.
 
+        With Subresource Integrity enabled, the requirements' integrity
+        values are included, so fragments are not reused once a file
+        changes.
+        """
+        digest = hashlib.md5(url_manifest.version or "")
+        integrity = settings.SUBRESOURCE_INTEGRITY
+        for requirement in requirements:
+            digest.update((u"%s\0%s\0" % (requirement.group, requirement.name)).encode("utf-8"))
+            if integrity:
+                renderer = get_renderer(requirement.group)
+                if renderer is not None:
+                    digest.update((renderer.get_integrity(requirement) or "") + "\0")
+        return "%s:%s" % (self.key_prefix, digest.hexdigest())
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            value = self.get_backend().get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.backend is not None:
+            self.get_backend().set(key, value)
+
+    def clear(self):
+        """
+        Forget all locally cached fragments.
+        """
+        self.local.clear()
+
+# The process-wide rendered fragment cache
+fragment_cache = FragmentCache(settings.FRAGMENT_CACHE_SIZE,
+                               settings.FRAGMENT_CACHE_BACKEND,
+                               settings.FRAGMENT_CACHE_KEY_PREFIX)
+
+
+def build_preload_links(requirements, limit):
+    """
+    Build ``Link`` header values preloading the first external requirements.
+
+    Requirements in groups without a ``PRELOAD_AS`` destination, or that
+    would be rendered as part of a bundle, are skipped. With Subresource
+    Integrity enabled, links to requirements with an integrity value carry
+    it and the CORS mode of their tags, so browsers can use the preload.
+    """
+    links = []
+    destinations = settings.PRELOAD_AS
+    bundle_groups = settings.BUNDLE_GROUPS
+    integrity_enabled = settings.SUBRESOURCE_INTEGRITY
+    for requirement in requirements:
+        if len(links) >= limit:
+            break
+        destination = destinations.get(requirement.group)
+        if destination is None or requirement.is_inline():
+            continue
+        renderer = get_renderer(requirement.group)
+        if renderer is None:
+            continue
+        if requirement.group in bundle_groups and renderer.can_bundle(requirement):
+            continue
+        link = "<%s>; rel=preload; as=%s" % (renderer.build_url(requirement), destination)
+        if integrity_enabled:
+            integrity = renderer.get_integrity(requirement)
+            if integrity:
+                link = '%s; crossorigin=anonymous; integrity="%s"' % (link, integrity)
+        links.append(link)
+    return links
+
+
+def requirements_digest(requirements):
+    """
+    Return a hex digest of an ordered list of requirements and the versions
+    of their assets, where known.
+
+    An external requirement's version is its URL, which is content-hashed
+    when a URL manifest is in use, and its integrity value when that is
+    known without reading the file. Inline requirements with literal
+    content include that content; content rendered from templates is part
+    of the page instead.
+    """
+    digest = hashlib.md5()
+    for requirement in requirements:
+        parts = [requirement.group or u"", requirement.name]
+        renderer = get_renderer(requirement.group)
+        if requirement.is_inline():
+            if isinstance(requirement.content, basestring):
+                parts.append(requirement.content)
+        elif renderer is not None:
+            parts.append(renderer.build_url(requirement))
+            if settings.SUBRESOURCE_INTEGRITY:
+                integrity = renderer.get_integrity(requirement)
+            else:
+                integrity = settings.INTEGRITY_HASHES.get(requirement.name)
+                if integrity is None and not requirement.is_qualified_url():
+                    integrity = url_manifest.get_integrity(renderer.directory + requirement.name)
+            parts.append(integrity or u"")
+        digest.update(u"\0".join(parts).encode("utf-8"))
+        digest.update("\n")
+    return digest.hexdigest()
+
+
+def render_sequence(requirements, context, stats=None):
+    """
+    Render each requirement with the renderer for its group.
+
+    Consecutive local requirements in a group listed in ``BUNDLE_GROUPS``
+    are rendered as a single bundle. Time spent rendering inline
+    requirements is added to ``stats`` if given.
+    """
+    parts = []
+    bundle_groups = settings.BUNDLE_GROUPS
+    run, run_renderer = [], None
+    for requirement in requirements:
+        renderer = get_renderer(requirement.group)
+        if not renderer:
+            continue
+        if bundle_groups and requirement.group in bundle_groups and renderer.can_bundle(requirement):
+            if renderer is not run_renderer:
+                parts.append(render_run(run, run_renderer, context))
+                run, run_renderer = [], renderer
+            run.append(requirement)
+            continue
+        parts.append(render_run(run, run_renderer, context))
+        run, run_renderer = [], None
+        if stats is not None and requirement.is_inline():
+            start = time.time()
+            parts.append(renderer.render(requirement, context))
+            stats.inline_time += time.time() - start
+        else:
+            parts.append(renderer.render(requirement, context))
+    parts.append(render_run(run, run_renderer, context))
+    return u"".join(parts)
+
+
+def render_run(requirements, renderer, context):
+    """
+    Render a run of bundleable requirements sharing a renderer.
+    """
+    if not requirements:
+        return u""
+    if len(requirements) == 1:
+        return renderer.render(requirements[0], context)
+    return renderer.render_bundle(requirements, context)
+
+
+def render_requirements(requirements, context, stats=None):
+    """
+    Render a sorted list of requirements.
+
+    When the fragment cache is enabled, the output for the leading run of
+    external requirements is cached; inline requirements are always
+    rendered against the given context. Rendering time is added to
+    ``stats`` if given.
+    """
+    if stats is None:
+        return render_cached(requirements, context, None)
+    start = time.time()
+    output = render_cached(requirements, context, stats)
+    stats.render_time += time.time() - start
+    return output
+
+
+def render_cached(requirements, context, stats):
+    if not fragment_cache.is_enabled():
+        return render_sequence(requirements, context, stats)
+    split = len(requirements)
+    for index, requirement in enumerate(requirements):
+        if requirement.is_inline():
+            split = index
+            break
+    if split == 0:
+        return render_sequence(requirements, context, stats)
+    key = fragment_cache.make_key(requirements[:split])
+    output = fragment_cache.get(key)
+    if output is None:
+        output = render_sequence(requirements[:split], context)
+        fragment_cache.set(key, output)
+    return output + render_sequence(requirements[split:], context, stats)
+
+
+# Case-insensitive, since wrapping tags such as ``{% filter upper %}`` may
+# have transformed a placeholder
+PLACEHOLDER_RE = re.compile(r"<!--require_media:([0-9a-f]+):(\d+)-->", re.I)
+
+def replace_placeholders(manager, content, charset="utf-8"):
+    """
+    Replace every placeholder in encoded response content in one pass.
+    """
+    from require_media.manager import PLACEHOLDER_NONCE
+    def replace(match):
+        if match.group(1).lower() != PLACEHOLDER_NONCE:
+            return match.group(0)
+        index = int(match.group(2))
+        if index >= len(manager.placeholders):
+            return match.group(0)
+        groups, context = manager.placeholders[index]
+        requirements = manager.get_sorted_requirements_for_groups(groups)
+        return render_requirements(requirements, context, manager.stats).encode(charset)
+    return PLACEHOLDER_RE.sub(replace, content)
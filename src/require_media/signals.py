@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+#: Sent by ``RequireMediaMiddleware`` for each response whose request used a
+#: requirement manager, when ``INSTRUMENTATION`` is enabled. ``stats`` is
+#: the dictionary returned by ``RequirementManager.get_stats``.
+requirements_rendered = Signal(providing_args=["request", "stats"])
@@ -0,0 +1,33 @@
+"""
+Helpers for writing generated media files.
+"""
+import hashlib
+
+from django.core.files.base import ContentFile
+
+from require_media.conf import settings
+
+def get_storage():
+    """
+    Get the storage instance generated files are written to.
+    """
+    if settings.STORAGE:
+        from require_media.utils import get_module_attribute
+        return get_module_attribute(settings.STORAGE)
+    from django.core.files.storage import default_storage
+    return default_storage
+
+def save_hashed(directory, content, extension):
+    """
+    Save content under a name derived from its hash and return its URL.
+
+    Files that already exist are not written again.
+    """
+    if isinstance(content, unicode):
+        content = content.encode("utf-8")
+    digest = hashlib.md5(content).hexdigest()
+    name = "%s%s.%s" % (directory, digest, extension)
+    storage = get_storage()
+    if not storage.exists(name):
+        storage.save(name, ContentFile(content))
+    return storage.url(name)
@@ -0,0 +1,58 @@
+"""
+Streaming responses that render requirements as they become known.
+
+Each ``{% render_requirements %}`` tag in a streamed template is a flush
+point: it renders the requirements declared so far that have not been
+rendered yet. Requirements declared afterwards are rendered in a trailing
+block at the end of the stream.
+"""
+from django.template.loader import get_template
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5 streams iterators given to a plain response
+    from django.http import HttpResponse as StreamingHttpResponse
+
+from require_media.conf import settings
+from require_media.renderers import render_requirements
+
+HEAD_END = "</head>"
+
+def stream_templates(templates, context, head_groups=None):
+    """
+    Render templates in sequence against one context, yielding each output.
+
+    ``templates`` may contain template names or compiled templates. If
+    ``head_groups`` is given, pending requirements for those groups are
+    also flushed just before the first ``</head>``.
+    """
+    manager = context.get(settings.CONTEXT_VAR_NAME, None)
+    if manager is not None:
+        manager.streaming = True
+    head_open = bool(head_groups)
+    for template in templates:
+        if isinstance(template, basestring):
+            template = get_template(template)
+        output = template.render(context)
+        if manager is not None and head_open and HEAD_END in output:
+            head_open = False
+            requirements = manager.get_pending_requirements_for_groups(head_groups)
+            manager.mark_rendered(requirements)
+            head, tail = output.split(HEAD_END, 1)
+            output = u"".join([head, render_requirements(requirements, context, manager.stats), HEAD_END, tail])
+        yield output
+    if manager is not None:
+        requirements = manager.get_pending_requirements_for_groups(settings.GROUPS, final=True)
+        manager.mark_rendered(requirements)
+        trailer = render_requirements(requirements, context, manager.stats)
+        if trailer:
+            yield trailer
+
+def streaming_response(templates, context, head_groups=None, **kwargs):
+    """
+    Return a response streaming the given templates.
+
+    Extra keyword arguments are passed to the response class.
+    """
+    return StreamingHttpResponse(stream_templates(templates, context, head_groups), **kwargs)
@@ -1,8 +1,9 @@
 from django import template
 
 from require_media.conf import settings
-from require_media.renderers import get_renderer
-from require_media.utils import determine_requirement_group
+from require_media.manager import ExternalRequirement, InlineRequirement
+from require_media.renderers import render_requirements, precompute_url
+from require_media.utils import resolve_require_arguments, resolve_require_inline_arguments
 
 register = template.Library()
 
@@ -16,17 +17,22 @@ def get_manager(context):
 class RequireInlineNode(template.Node):
     """
     Registers an inline media requirement with the requirement manager.
+
+    The requirement is built once and shared by every render, since its
+    content is the nodelist rather than rendered output.
     """
-    def __init__(self, requirement, nodelist, group=None, depends=None):
+    def __init__(self, requirement, nodelist, group=None, depends=None, priority=0):
         self.requirement = requirement
         self.nodelist = nodelist
         self.group = group
         self.depends = depends or []
+        static = all([isinstance(node, template.TextNode) for node in nodelist])
+        self.node = InlineRequirement(requirement, nodelist, group, self.depends, priority, static)
 
     def render(self, context):
         manager = get_manager(context)
         if manager is not None:
-            manager.add_inline(self.requirement, self.nodelist, self.group, self.depends)
+            manager.add_node(self.node)
         return u""
 
 def compile_require_inline_node(parser, token):
@@ -37,7 +43,9 @@ def compile_require_inline_node(parser, token):
     and ``group``, which is a type identifier for the block.
 
     All further arguments specify requirements the one being defined
-    depends upon.
+    depends upon, except for an optional ``priority=<n>``. Of the
+    requirements whose dependencies have all been rendered, the one with
+    the lowest priority renders next; the default is zero.
 
     A simple example::
     
@@ -53,15 +61,11 @@ def compile_require_inline_node(parser, token):
     parts = token.split_contents()
     nodelist = parser.parse(('end_require_inline',))
     parser.delete_first_token()
-    if not len(parts) >= 3:
-        raise template.TemplateSyntaxError("%s tag requires two arguments: name and group" % parts[0])
-    tag_name, requirement, group, depends_on = parts[0], parts[1], parts[2], parts[3:]
-    requirement_aliases = settings.REQUIREMENT_ALIASES or {}
-    group_aliases = settings.REQUIREMENT_GROUP_ALIASES or {}
-    requirement = requirement_aliases.get(requirement) or requirement
-    group = group_aliases.get(group) or group
-    depends_on = [requirement_aliases.get(dependency, dependency) for dependency in depends_on]
-    return RequireInlineNode(requirement, nodelist, group, depends_on)
+    try:
+        requirement, group, depends_on, priority = resolve_require_inline_arguments(parts[1:])
+    except ValueError:
+        raise template.TemplateSyntaxError("%s tag requires two arguments, name and group, and an integer priority" % parts[0])
+    return RequireInlineNode(requirement, nodelist, group, depends_on, priority)
 
 register.tag("require_inline", compile_require_inline_node)
 
@@ -72,16 +76,21 @@ register.tag("require_inline", compile_require_inline_node)
 class RequireNode(template.Node):
     """
     Registers an external media requirement with the requirement manager.
+
+    The requirement is built, and its URL computed, once when the template
+    is compiled and shared by every render.
     """
-    def __init__(self, requirement, group=None, depends_on=None):
+    def __init__(self, requirement, group=None, depends_on=None, priority=0):
         self.requirement = requirement
         self.group = group
         self.depends_on = depends_on or []
+        self.node = ExternalRequirement(requirement, group, self.depends_on, priority)
+        precompute_url(self.node)
 
     def render(self, context):
         manager = get_manager(context)
         if manager is not None:
-            manager.add_external(self.requirement, self.group, self.depends_on)
+            manager.add_node(self.node)
         return u""
 
 def compile_require_node(parser, token):
@@ -90,12 +99,14 @@ def compile_require_node(parser, token):
     
     The tag is invoked with the following signature::
 
-        {% require [<group>] requirement [<depends> ...] %}
+        {% require [<group>] requirement [<depends> ...] [priority=<n>] %}
 
     The optional ``group`` argument specifies a requirement group, such as
     "css" or "js", the ``requirement`` argument specifies the desired
     requirement, and all further arguments are interpreted as requirements
-    of the one currently being specified.
+    of the one currently being specified. Of the requirements whose
+    dependencies have all been rendered, the one with the lowest optional
+    ``priority`` renders next; the default is zero.
 
     A simple example that causes ``jquery.js`` to be added to the list of
     ``js`` requirements for the current request::
@@ -111,27 +122,66 @@ def compile_require_node(parser, token):
     parts = token.split_contents()
     if not len(parts) >= 2:
         raise template.TemplateSyntaxError("%s tag requires one or more arguments" % parts[0])
-    tag_name, args = parts[0], parts[1:]
-
-    group_aliases = settings.REQUIREMENT_GROUP_ALIASES or {}
-    requirement_aliases = settings.REQUIREMENT_ALIASES or {}
-    potential_group = group_aliases.get(args[0]) or args[0]
-    if potential_group and potential_group in settings.GROUPS:
-        if not len(args) >= 2:
-            raise template.TemplateSyntaxError("%s tag requires a requirement to be specified" % parts[0])
-        group = potential_group
-        args = args[1:]
-    else:
-        group = None
-    requirement = requirement_aliases.get(args[0]) or args[0]
-    depends_on = args[1:]
-    depends_on = [requirement_aliases.get(dependency, dependency) for dependency in depends_on]
-    if group is None:
-        group = determine_requirement_group(requirement, settings.GROUPS)
-    return RequireNode(requirement, group, depends_on)
+    try:
+        requirement, group, depends_on, priority = resolve_require_arguments(parts[1:])
+    except ValueError:
+        raise template.TemplateSyntaxError("%s tag requires a requirement to be specified and an integer priority" % parts[0])
+    return RequireNode(requirement, group, depends_on, priority)
 
 register.tag("require", compile_require_node)
 
+#
+# require_many
+#
+
+class RequireManyNode(template.Node):
+    """
+    Registers the requirements of several ``require`` and ``require_inline``
+    tags with the requirement manager at once.
+    """
+    child_nodelists = ("nodelist",)
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+        self.nodes = tuple([node.node for node in nodelist
+                            if isinstance(node, (RequireNode, RequireInlineNode))])
+
+    def render(self, context):
+        manager = get_manager(context)
+        if manager is not None:
+            manager.add_many(self.nodes)
+        return u""
+
+def compile_require_many_node(parser, token):
+    """
+    Registers the requirements declared by the enclosed tags together.
+
+    The block may only contain ``require`` and ``require_inline`` tags,
+    which are registered in order with a single update of the requirement
+    manager::
+
+        {% require_many %}
+            {% require js jquery.js %}
+            {% require js jquery-ui.js jquery.js %}
+            {% require css jquery-ui.css %}
+        {% end_require_many %}
+
+    """
+    parts = token.split_contents()
+    if len(parts) != 1:
+        raise template.TemplateSyntaxError("%s tag takes no arguments" % parts[0])
+    nodelist = parser.parse(('end_require_many',))
+    parser.delete_first_token()
+    for node in nodelist:
+        if isinstance(node, (RequireNode, RequireInlineNode)):
+            continue
+        if isinstance(node, template.TextNode) and not node.s.strip():
+            continue
+        raise template.TemplateSyntaxError("%s tag may only contain require and require_inline tags" % parts[0])
+    return RequireManyNode(nodelist)
+
+register.tag("require_many", compile_require_many_node)
+
 
 #
 # render_requirements
@@ -157,13 +207,13 @@ class DelayedRequirementsRenderer(object):
         self.context = context
 
     def __unicode__(self):
-        parts = []
-        requirements = self.manager.get_sorted_requirements_for_groups(self.groups)
-        for requirement in requirements:
-            renderer = get_renderer(requirement.group)
-            if renderer:
-                parts.append(renderer.render(requirement, self.context))
-        return u"".join(parts)
+        if self.manager.streaming:
+            # Render only what has not been flushed to the stream already
+            requirements = self.manager.get_pending_requirements_for_groups(self.groups)
+            self.manager.mark_rendered(requirements)
+        else:
+            requirements = self.manager.get_sorted_requirements_for_groups(self.groups)
+        return render_requirements(requirements, self.context, self.manager.stats)
 
 
 class RenderRequirementsNode(template.Node):
@@ -180,6 +230,8 @@ class RenderRequirementsNode(template.Node):
     def render(self, context):
         manager = get_manager(context)
         if manager:
+            if settings.PLACEHOLDER_MODE and not manager.streaming:
+                return manager.add_placeholder(self.groups, context)
             return DelayedRequirementsRenderer(manager, self.groups, context)
         return u""
 
@@ -1,40 +1,73 @@
+import os
+import sys
+import base64
+import hashlib
+
 from django.utils import unittest, importlib
 from django.test import TestCase as DjangoTestCase
 from django.test.client import RequestFactory
 from django.conf import settings as project_settings
-from django.core.exceptions import MiddlewareNotUsed
+from django.core.exceptions import MiddlewareNotUsed, ImproperlyConfigured
 from django import template
 
 from require_media.conf import settings
 from require_media import manager
 from require_media import renderers
 from require_media import utils
+from require_media import caches
+from require_media import analysis
+from require_media import minifiers
+from require_media import middleware
+from require_media import signals
+
+try:
+    import jinja2
+except ImportError:
+    jinja2 = None
 
 request_factory = RequestFactory()
 
+# The storage instance used by tests writing generated files
+test_storage = None
+
 class RequirementTestCase(unittest.TestCase):
     def test_initialization(self):
         requirement = manager.Requirement("jquery.js")
         self.assertEquals("jquery.js", requirement.name)
         self.assertFalse(requirement.group)
-        self.assertEquals([], requirement.depends_on)
+        self.assertEquals((), requirement.depends_on)
 
         self.assertFalse(requirement.is_inline())
 
         requirement = manager.Requirement("jquery.js", "js")
         self.assertEquals("jquery.js", requirement.name)
         self.assertEquals("js", requirement.group)
-        self.assertEquals([], requirement.depends_on)
+        self.assertEquals((), requirement.depends_on)
 
         self.assertFalse(requirement.is_inline())
 
         requirement = manager.Requirement("jquery-ui.js", "js", ["jquery.js"])
         self.assertEquals("jquery-ui.js", requirement.name)
         self.assertEquals("js", requirement.group)
-        self.assertEquals(["jquery.js"], requirement.depends_on)
+        self.assertEquals(("jquery.js",), requirement.depends_on)
 
         self.assertFalse(requirement.is_inline())
 
+    def test_compact(self):
+        requirement = manager.ExternalRequirement(u"jquery.js", u"js")
+        self.assertFalse(hasattr(requirement, "__dict__"))
+        self.assertTrue(requirement.depends_on is manager.EMPTY_DEPENDENCIES)
+        self.assertFalse(hasattr(manager.InlineRequirement("a", "", "js"), "__dict__"))
+
+    def test_interned_names(self):
+        name, group, depends_on, priority = utils.resolve_require_arguments([u"js", "".join([u"jquery", u"-ui.js"]), u"jquery.js"])
+        other = utils.resolve_require_arguments([u"js", "".join([u"jquery", u".js"])])[0]
+        self.assertTrue(depends_on[0] is other)
+        self.assertTrue(name is utils.resolve_require_inline_arguments(["".join([u"jquery", u"-ui.js"]), u"js"])[0])
+        size = len(utils.interned_names)
+        manager.ExternalRequirement(u"runtime-%d.js" % size, u"js", [u"runtime.js"])
+        self.assertEquals(size, len(utils.interned_names))
+
     def test_is_qualified_url(self):
         requirement = manager.Requirement("jquery.js")
         self.assertFalse(requirement.is_qualified_url())
@@ -55,7 +88,7 @@ class InlineRequirementTestCase(unittest.TestCase):
         self.assertEquals("test", requirement.name)
         self.assertEquals("var foo = null;", requirement.content)
         self.assertFalse(requirement.group)
-        self.assertEquals([], requirement.depends_on)
+        self.assertEquals((), requirement.depends_on)
 
         self.assertTrue(requirement.is_inline())
 
@@ -63,7 +96,7 @@ class InlineRequirementTestCase(unittest.TestCase):
         self.assertEquals("test", requirement.name)
         self.assertEquals("var foo = null;", requirement.content)
         self.assertEquals("js", requirement.group)
-        self.assertEquals([], requirement.depends_on)
+        self.assertEquals((), requirement.depends_on)
 
         self.assertTrue(requirement.is_inline())
 
@@ -71,7 +104,7 @@ class InlineRequirementTestCase(unittest.TestCase):
         self.assertEquals("test", requirement.name)
         self.assertEquals("var foo = null;", requirement.content)
         self.assertEquals("js", requirement.group)
-        self.assertEquals(["jquery.js"], requirement.depends_on)
+        self.assertEquals(("jquery.js",), requirement.depends_on)
 
         self.assertTrue(requirement.is_inline())
 
@@ -145,6 +178,233 @@ class RequirementManagerTestCase(unittest.TestCase):
         should_be = ["jquery.js", "jquery.ui.core.js", "jquery.effects.core.js", "jquery.effects.scale.js", "jquery.ui.accordion.js"]
         self.assertEquals(should_be, names)
 
+    def test_sort_cache(self):
+        manager.sort_cache.clear()
+        def build(*extra):
+            m = manager.RequirementManager()
+            m.add_external("jquery-ui.js", "js", ["jquery.js"])
+            m.add_external("jquery.js", "js")
+            for name in extra:
+                m.add_external(name, "js")
+            return m
+        first = [r.name for r in build().get_sorted_requirements()]
+        self.assertEquals(0, manager.sort_cache.stats()["hits"])
+        self.assertEquals(1, manager.sort_cache.stats()["misses"])
+        second = build()
+        self.assertEquals(first, [r.name for r in second.get_sorted_requirements()])
+        self.assertEquals(1, manager.sort_cache.stats()["hits"])
+        names = [r.name for r in build("other.js").get_sorted_requirements()]
+        self.assertTrue("other.js" in names)
+        self.assertEquals(2, manager.sort_cache.stats()["misses"])
+
+    def test_sort_does_not_mutate_graph(self):
+        m = manager.RequirementManager()
+        m.add_external("jquery-ui.js", "js", ["jquery.js"])
+        m.add_external("jquery.js", "js")
+        self.assertEquals([1, set()], m.graph["jquery.js"])
+        utils.topological_sort(m.graph)
+        self.assertEquals([1, set()], m.graph["jquery.js"])
+        self.assertEquals(["jquery.js", "jquery-ui.js"], utils.topological_sort(m.graph)[::-1])
+
+    def assertOrdered(self, m):
+        names = [requirement.name for requirement in m.get_sorted_requirements()]
+        self.assertEquals(len(m.requirements_map), len(names))
+        for name in names:
+            for dependency in m.get_dependencies(name):
+                self.assertTrue(names.index(dependency) < names.index(name))
+
+    def assertCanonical(self, m):
+        order = [requirement.name for requirement in m.get_sorted_requirements()]
+        names = [name for name in utils.topological_sort(m.graph, m.sort_key)[::-1] if name in m.requirements_map]
+        self.assertEquals(names, order)
+
+    def test_incremental_order(self):
+        m = manager.RequirementManager()
+        m.add_external("app.js", "js", ["jquery-ui.js"])
+        m.add_external("jquery-ui.js", "js", ["jquery.js"])
+        m.add_external("jquery.js", "js")
+        self.assertOrdered(m)
+        manager.sort_cache.clear()
+        # New nodes after existing ones are appended
+        m.add_external("plugin.js", "js", ["jquery.js", "json2.js"])
+        m.add_external("json2.js", "js")
+        self.assertOrdered(m)
+        self.assertCanonical(m)
+        self.assertEquals(0, manager.sort_cache.stats()["misses"])
+        # New dependencies of already placed nodes mean sorting again
+        m.add_external("jquery.js", "js", ["es5-shim.js"])
+        m.add_external("es5-shim.js", "js")
+        self.assertOrdered(m)
+        self.assertCanonical(m)
+        m.add_external("jquery-ui.js", "js", ["plugin.js"])
+        self.assertOrdered(m)
+        self.assertCanonical(m)
+        self.assertEquals(2, manager.sort_cache.stats()["misses"])
+
+    def get_orders(self, registrations):
+        """
+        Return the final order of each of the registrations with the
+        requirements read after each, and never, registration.
+        """
+        orders = []
+        for read_after in range(len(registrations) + 1):
+            m = manager.RequirementManager()
+            for index, (name, depends_on, priority) in enumerate(registrations):
+                if index == read_after:
+                    m.get_sorted_requirements()
+                m.add_external(name, "js", depends_on, priority)
+            orders.append([requirement.name for requirement in m.get_sorted_requirements()])
+        return orders
+
+    def test_order_independent_of_reads(self):
+        orders = self.get_orders([
+            ("app.js", ["jquery-ui.js", "json2.js"], 0),
+            ("jquery-ui.js", ["jquery.js"], 0),
+            ("plugin.js", ["jquery.js"], 0),
+            ("jquery.js", [], 0),
+            ("json2.js", [], 0),
+            ("jquery.js", ["es5-shim.js"], 0),
+            ("es5-shim.js", [], 0),
+        ])
+        self.assertEquals(["json2.js", "es5-shim.js", "jquery.js", "jquery-ui.js", "app.js", "plugin.js"], orders[0])
+        for order in orders:
+            self.assertEquals(orders[0], order)
+
+    def test_priority_order_independent_of_reads(self):
+        orders = self.get_orders([
+            ("a.js", [], 1),
+            ("b.js", ["c.js"], 1),
+            ("c.js", [], 0),
+        ])
+        self.assertEquals(["c.js", "a.js", "b.js"], orders[-1])
+        for order in orders:
+            self.assertEquals(orders[-1], order)
+
+    def test_ties_broken_by_registration(self):
+        m = manager.RequirementManager()
+        for name in ["c.js", "a.js", "b.js"]:
+            m.add_external(name, "js")
+        self.assertEquals(["c.js", "a.js", "b.js"], [r.name for r in m.get_sorted_requirements()])
+
+    def test_priority(self):
+        m = manager.RequirementManager()
+        m.add_external("app.js", "js", ["jquery.js"])
+        m.add_external("jquery.js", "js")
+        m.get_sorted_requirements()
+        m.add_external("analytics.js", "js", priority=-1)
+        m.add_external("late.js", "js", priority=1)
+        m.add_external("other.js", "js")
+        self.assertEquals(["analytics.js", "jquery.js", "app.js", "other.js", "late.js"],
+                          [r.name for r in m.get_sorted_requirements()])
+        self.assertCanonical(m)
+
+    def test_priority_of_unrelated_requirements(self):
+        m = manager.RequirementManager()
+        m.add_external("x.js", "js", priority=5)
+        m.add_external("y.js", "js", ["z.js"])
+        m.add_external("z.js", "js", priority=10)
+        self.assertEquals(["x.js", "z.js", "y.js"], [r.name for r in m.get_sorted_requirements()])
+
+    def test_priority_first_registration_wins(self):
+        m = manager.RequirementManager()
+        m.add_external("a.js", "js")
+        m.add_external("b.js", "js")
+        m.add_external("b.js", "js", priority=-1)
+        self.assertEquals(["a.js", "b.js"], [r.name for r in m.get_sorted_requirements()])
+
+    def test_cycle(self):
+        m = manager.RequirementManager()
+        m.add_external("b.js", "js", ["a.js"])
+        m.add_external("a.js", "js")
+        self.assertOrdered(m)
+        m.add_external("a.js", "js", ["b.js"])
+        self.assertEquals(None, m.order)
+        try:
+            m.get_sorted_requirements()
+        except utils.CyclicDependencyError:
+            error = sys.exc_info()[1]
+            self.assertEquals(["b.js", "a.js", "b.js"], error.nodes)
+            self.assertTrue("b.js -> a.js -> b.js" in str(error))
+        else:
+            self.fail("CyclicDependencyError not raised")
+
+    def test_self_dependency(self):
+        m = manager.RequirementManager()
+        m.add_external("a.js", "js")
+        m.get_sorted_requirements()
+        m.add_external("b.js", "js", ["b.js"])
+        self.assertRaises(utils.CyclicDependencyError, m.get_sorted_requirements)
+
+    def test_duplicate_registrations(self):
+        m = manager.RequirementManager()
+        for i in range(10):
+            m.add_external("jquery-ui.js", "js", ["jquery.js"])
+            m.add_external("jquery.js", "js")
+        self.assertEquals(2, len(m.requirements))
+        self.assertEquals([1, set()], m.graph["jquery.js"])
+        self.assertEquals([0, set(["jquery.js"])], m.graph["jquery-ui.js"])
+        single = manager.RequirementManager()
+        single.add_external("jquery-ui.js", "js", ["jquery.js"])
+        single.add_external("jquery.js", "js")
+        self.assertEquals(single.fingerprint, m.fingerprint)
+
+    def test_duplicate_registration_merges_dependencies(self):
+        m = manager.RequirementManager()
+        m.add_external("app.js", "js", ["jquery.js"])
+        m.add_external("app.js", "js", ["json2.js", "jquery.js"])
+        m.add_external("jquery.js", "js")
+        m.add_external("json2.js", "js")
+        self.assertEquals(3, len(m.requirements))
+        self.assertEquals(set(["jquery.js", "json2.js"]), m.get_dependencies("app.js"))
+        self.assertEquals(1, m.graph["jquery.js"][0])
+        self.assertEquals("app.js", m.get_sorted_requirements()[-1].name)
+
+    def test_fingerprint(self):
+        a = manager.RequirementManager()
+        b = manager.RequirementManager()
+        self.assertEquals(a.fingerprint, b.fingerprint)
+        a.add_external("jquery.js", "js")
+        self.assertNotEquals(a.fingerprint, b.fingerprint)
+        b.add_external("jquery.js", "js")
+        self.assertEquals(a.fingerprint, b.fingerprint)
+        a.add_external("jquery-ui.js", "js", ["jquery.js"])
+        b.add_external("jquery-ui.js", "js")
+        self.assertNotEquals(a.fingerprint, b.fingerprint)
+
+
+class AddManyTestCase(unittest.TestCase):
+    def test_same_as_add_node(self):
+        nodes = [
+            manager.ExternalRequirement("jquery-ui.js", "js", ["jquery.js"]),
+            manager.ExternalRequirement("jquery.js", "js"),
+            manager.ExternalRequirement("jquery-ui.js", "js", ["reset.css"]),
+            manager.ExternalRequirement("reset.css", "css"),
+        ]
+        single = manager.RequirementManager()
+        for node in nodes:
+            single.add_node(node)
+        many = manager.RequirementManager()
+        many.add_many(nodes)
+        self.assertEquals(single.fingerprint, many.fingerprint)
+        self.assertEquals(single.requirements, many.requirements)
+        self.assertEquals([r.name for r in single.get_sorted_requirements()],
+                          [r.name for r in many.get_sorted_requirements()])
+
+    def test_after_sorting(self):
+        m = manager.RequirementManager()
+        m.add_external("b.js", "js", ["a.js"])
+        m.add_external("a.js", "js")
+        m.get_sorted_requirements()
+        m.add_many([manager.ExternalRequirement("c.js", "js"), manager.ExternalRequirement("a.js", "js", ["c.js"])])
+        self.assertEquals(["c.js", "a.js", "b.js"], [r.name for r in m.get_sorted_requirements()])
+
+    def test_unchanged(self):
+        m = manager.RequirementManager()
+        m.add_external("a.js", "js")
+        sorted_requirements = m.get_sorted_requirements()
+        m.add_many([manager.ExternalRequirement("a.js", "js")])
+        self.assertTrue(sorted_requirements is m.get_sorted_requirements())
+
 
 class RequirementRendererTestCase(unittest.TestCase):
     def test_get_renderer(self):
@@ -159,8 +419,585 @@ class RequirementRendererTestCase(unittest.TestCase):
         renderer = renderers.get_renderer("vbscript")
         self.assertEquals(None, renderer)
 
+    def test_registry_caches_renderers(self):
+        registry = renderers.RendererRegistry()
+        renderer = registry.get("js")
+        self.assertEquals(renderers.javascript_requirement_renderer, renderer)
+        self.assertTrue(registry.paths is settings.RENDERERS)
+        registry.renderers["js"] = renderers.css_requirement_renderer
+        self.assertEquals(renderers.css_requirement_renderer, registry.get("js"))
+
+    def test_registry_rebuilds_on_settings_change(self):
+        registry = renderers.RendererRegistry()
+        self.assertEquals(renderers.javascript_requirement_renderer, registry.get("js"))
+        original = settings.RENDERERS
+        settings.attributes["RENDERERS"] = {"js": "require_media.renderers.css_requirement_renderer"}
+        try:
+            self.assertEquals(renderers.css_requirement_renderer, registry.get("js"))
+            self.assertEquals(None, registry.get("css"))
+        finally:
+            settings.attributes["RENDERERS"] = original
+
+    def test_registry_bad_path(self):
+        registry = renderers.RendererRegistry()
+        original = settings.RENDERERS
+        settings.attributes["RENDERERS"] = {"js": "require_media.renderers.missing_renderer"}
+        try:
+            self.assertRaises(ImproperlyConfigured, registry.populate)
+            settings.attributes["RENDERERS"] = {"js": "require_media.missing.renderer"}
+            self.assertRaises(ImproperlyConfigured, registry.get, "js")
+        finally:
+            settings.attributes["RENDERERS"] = original
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_get_set(self):
+        cache = caches.LRUCache(2)
+        self.assertEquals(None, cache.get("a"))
+        cache.set("a", 1)
+        self.assertEquals(1, cache.get("a"))
+        self.assertEquals({"hits": 1, "misses": 1, "size": 1, "max_size": 2}, cache.stats())
+
+    def test_eviction(self):
+        cache = caches.LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertTrue("c" in cache)
+        self.assertEquals(2, len(cache))
+
+    def test_clear(self):
+        cache = caches.LRUCache(2)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.clear()
+        self.assertEquals(None, cache.get("a"))
+        self.assertEquals({"hits": 0, "misses": 1, "size": 0, "max_size": 2}, cache.stats())
+
+    def test_disabled(self):
+        cache = caches.LRUCache(0)
+        cache.set("a", 1)
+        self.assertEquals(0, len(cache))
+
+
+class URLCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        renderers.url_cache.clear()
+
+    def test_build_url_cached(self):
+        renderer = renderers.javascript_requirement_renderer
+        requirement = manager.ExternalRequirement("jquery.js", "js")
+        self.assertEquals("/media/js/jquery.js", renderer.build_url(requirement))
+        self.assertEquals("/media/js/jquery.js", renderer.build_url(requirement))
+        stats = renderers.url_cache.stats()
+        self.assertEquals(1, stats["hits"])
+        self.assertEquals(1, stats["misses"])
+
+    def test_keyed_by_renderer(self):
+        requirement = manager.ExternalRequirement("reset", "css")
+        self.assertEquals("/media/js/reset", renderers.javascript_requirement_renderer.build_url(requirement))
+        self.assertEquals("/media/css/reset", renderers.css_requirement_renderer.build_url(requirement))
+
+    def test_qualified_url(self):
+        requirement = manager.ExternalRequirement("http://example.com/example.js", "js")
+        url = renderers.javascript_requirement_renderer.build_url(requirement)
+        self.assertEquals("http://example.com/example.js", url)
+
+    def test_precomputed_url(self):
+        renderer = renderers.javascript_requirement_renderer
+        requirement = manager.ExternalRequirement("jquery.js", "js")
+        renderers.precompute_url(requirement)
+        self.assertEquals("/media/js/jquery.js", requirement.url[2])
+        renderer.build_url(requirement)
+        self.assertEquals(0, renderers.url_cache.stats()["hits"])
+        self.assertEquals("/media/css/jquery.js", renderers.css_requirement_renderer.build_url(requirement))
+
+    def test_precomputed_url_refreshed(self):
+        requirement = manager.ExternalRequirement("jquery.js", "js")
+        renderers.precompute_url(requirement)
+        requirement.url = (requirement.url[0], requirement.url[1], "/stale.js")
+        renderers.url_cache.clear()
+        self.assertEquals("/media/js/jquery.js", renderers.javascript_requirement_renderer.build_url(requirement))
+        self.assertEquals(renderers.url_cache.generation, requirement.url[1])
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original = renderers.fragment_cache
+        renderers.fragment_cache = renderers.FragmentCache(10, key_prefix="test")
+
+    def tearDown(self):
+        renderers.fragment_cache = self.original
+
+    def get_manager(self):
+        m = manager.RequirementManager()
+        m.add_external("jquery-ui.js", "js", ["jquery.js"])
+        m.add_external("jquery.js", "js")
+        return m
+
+    def test_disabled_by_default(self):
+        self.assertFalse(self.original.is_enabled())
+
+    def test_cache_hit(self):
+        expected = u'<script src="/media/js/jquery.js"></script><script src="/media/js/jquery-ui.js"></script>'
+        for i in range(2):
+            requirements = self.get_manager().get_sorted_requirements()
+            self.assertEquals(expected, renderers.render_requirements(requirements, None))
+        stats = renderers.fragment_cache.local.stats()
+        self.assertEquals(1, stats["hits"])
+        self.assertEquals(1, stats["misses"])
+
+    def test_key(self):
+        requirements = self.get_manager().get_sorted_requirements()
+        cache = renderers.fragment_cache
+        self.assertEquals(cache.make_key(requirements), cache.make_key(list(requirements)))
+        self.assertNotEquals(cache.make_key(requirements), cache.make_key(requirements[:1]))
+        self.assertTrue(cache.make_key(requirements).startswith("test:"))
+
+    def test_inline_suffix_not_cached(self):
+        m = self.get_manager()
+        m.add_inline("setup", "var a = 1;", "js", ["jquery-ui.js"])
+        requirements = m.get_sorted_requirements()
+        output = renderers.render_requirements(requirements, None)
+        self.assertEquals(u'<script src="/media/js/jquery.js"></script><script src="/media/js/jquery-ui.js"></script><script>var a = 1;</script>', output)
+        self.assertEquals([u'<script src="/media/js/jquery.js"></script><script src="/media/js/jquery-ui.js"></script>'],
+                          [link[3] for link in renderers.fragment_cache.local.links.values()])
+
+    def test_backend(self):
+        from django.core.cache import get_cache
+        backend = get_cache("locmem://")
+        renderers.fragment_cache = renderers.FragmentCache(0, backend, "test")
+        requirements = self.get_manager().get_sorted_requirements()
+        output = renderers.render_requirements(requirements, None)
+        self.assertEquals(output, backend.get(renderers.fragment_cache.make_key(requirements)))
+
+
+class AnalysisTestCase(unittest.TestCase):
+    def test_find_templates(self):
+        names = analysis.find_templates()
+        self.assertTrue("example1/base.html" in names)
+        self.assertTrue("example3/css.html" in names)
+
+    def test_analyze_include(self):
+        result = analysis.analyze_template("example1/example1.html")
+        names = [requirement["name"] for requirement in result["requirements"]]
+        self.assertEquals(["jquery.js", "jquery-ui.js", "jquery-ui.css"], names)
+        self.assertEquals(["jquery.js"], result["requirements"][1]["depends_on"])
+        self.assertEquals(0, result["requirements"][1]["priority"])
+        self.assertTrue(result["order"].index("jquery.js") < result["order"].index("jquery-ui.js"))
+
+    def test_analyze_blocks_and_inline(self):
+        result = analysis.analyze_template("example2/example2.html")
+        inline = [requirement for requirement in result["requirements"] if requirement["inline"]]
+        self.assertEquals(1, len(inline))
+        self.assertEquals("messages_dialog", inline[0]["name"])
+        self.assertEquals("messages_dialog", result["order"][-1])
+        result = analysis.analyze_template("example3/example3.html")
+        self.assertEquals(3, len(result["requirements"]))
+
+    def test_extends_expression(self):
+        from django.template.loader import get_template
+        expected = len(list(analysis.iter_requirement_nodes(get_template("example2/example2.html").nodelist)))
+        extending = get_template("example2/example2.html")
+        parser = template.Parser([])
+        extending.nodelist[0].parent_name = template.FilterExpression('"example2/base.html"', parser)
+        self.assertEquals(expected, len(list(analysis.iter_requirement_nodes(extending.nodelist))))
+        extending.nodelist[0].parent_name = template.FilterExpression("parent", parser)
+        self.assertEquals([], list(analysis.iter_requirement_nodes(extending.nodelist)))
+
+    def test_block_super(self):
+        source = ('{%% extends "example3/example3.html" %%}{%% load require_media_tags %%}'
+                  '{%% block content %%}{%% require js app.js %%}%s{%% require js late.js %%}{%% endblock %%}')
+        t = template.Template(source % "{{ block.super }}")
+        names = [node.requirement for node in analysis.iter_requirement_nodes(t.nodelist)]
+        self.assertEquals(["app.js", "jquery.js", "jquery-ui.js", "jquery-ui.css", "late.js"], names)
+        t = template.Template(source % "")
+        names = [node.requirement for node in analysis.iter_requirement_nodes(t.nodelist)]
+        self.assertEquals(["app.js", "late.js"], names)
+
+    def test_build_manifest(self):
+        manifest, errors = analysis.build_manifest(["example1/base.html", "example3/css.html", "missing.html"])
+        self.assertEquals(analysis.MANIFEST_VERSION, manifest["version"])
+        self.assertEquals(["example1/base.html"], manifest["templates"].keys())
+        self.assertEquals(["missing.html"], [name for name, error in errors])
+
+    def test_warm_sort_cache(self):
+        manifest, errors = analysis.build_manifest(["example2/example2.html"])
+        manager.sort_cache.clear()
+        analysis.warm_sort_cache(manifest)
+        self.assertEquals(1, len(manager.sort_cache))
+        m = manager.RequirementManager()
+        for requirement in manifest["templates"]["example2/example2.html"]["requirements"]:
+            if requirement["inline"]:
+                m.add_inline(requirement["name"], "", requirement["group"], requirement["depends_on"])
+            else:
+                m.add_external(requirement["name"], requirement["group"], requirement["depends_on"])
+        m.get_sorted_requirements()
+        self.assertEquals(1, manager.sort_cache.stats()["hits"])
+
+    def test_command(self):
+        import os
+        import tempfile
+        from django.core.management import call_command
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            call_command("requirement_manifest", "example1/example1.html", output=path)
+            manifest = analysis.load_manifest(path)
+        finally:
+            os.remove(path)
+        self.assertEquals(["example1/example1.html"], manifest["templates"].keys())
+
+
+class MediaRootTestCase(unittest.TestCase):
+    """
+    Points the renderers and storage at a temporary media root.
+    """
+    overrides = {}
+
+    def setUp(self):
+        import tempfile
+        from django.core.files.storage import FileSystemStorage
+        global test_storage
+        self.media_root = tempfile.mkdtemp()
+        for directory in ("js", "css"):
+            os.mkdir(os.path.join(self.media_root, directory))
+        test_storage = FileSystemStorage(self.media_root, "/media/")
+        self.original_media_root = renderers.MEDIA_ROOT
+        renderers.MEDIA_ROOT = self.media_root
+        self.original_settings = settings.attributes.copy()
+        settings.attributes["STORAGE"] = "require_media.tests.test_storage"
+        settings.attributes.update(self.overrides)
+        renderers.url_cache.clear()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.media_root)
+        renderers.MEDIA_ROOT = self.original_media_root
+        settings.attributes = self.original_settings
+        renderers.url_cache.clear()
+
+    def write(self, path, content):
+        media_file = open(os.path.join(self.media_root, path), "w")
+        media_file.write(content)
+        media_file.close()
+
+
+class BundleTestCase(MediaRootTestCase):
+    overrides = {"BUNDLE_GROUPS": ["js"]}
+
+    def setUp(self):
+        super(BundleTestCase, self).setUp()
+        renderers.bundle_cache.clear()
+        self.write("js/jquery.js", "var jQuery;")
+        self.write("js/jquery-ui.js", "jQuery.ui = {};")
+
+    def tearDown(self):
+        super(BundleTestCase, self).tearDown()
+        renderers.bundle_cache.clear()
+
+    def get_manager(self):
+        m = manager.RequirementManager()
+        m.add_external("jquery-ui.js", "js", ["jquery.js"])
+        m.add_external("jquery.js", "js")
+        return m
+
+    def test_bundle(self):
+        output = renderers.render_requirements(self.get_manager().get_sorted_requirements(), None)
+        digest = hashlib.md5("var jQuery;\n;\njQuery.ui = {};").hexdigest()
+        self.assertEquals(u'<script src="/media/require_media/bundles/%s.js"></script>' % digest, output)
+        self.assertTrue(test_storage.exists("require_media/bundles/%s.js" % digest))
+
+    def test_bundle_reused(self):
+        renderers.render_requirements(self.get_manager().get_sorted_requirements(), None)
+        renderers.render_requirements(self.get_manager().get_sorted_requirements(), None)
+        self.assertEquals(1, renderers.bundle_cache.stats()["hits"])
+
+    def test_passthrough(self):
+        m = self.get_manager()
+        m.add_external("http://example.com/map.js", "js", ["jquery-ui.js"])
+        m.add_external("app.js", "js", ["http://example.com/map.js"])
+        m.add_inline("setup", "init();", "js", ["app.js"])
+        output = renderers.render_requirements(m.get_sorted_requirements(), None)
+        digest = hashlib.md5("var jQuery;\n;\njQuery.ui = {};").hexdigest()
+        expected = (u'<script src="/media/require_media/bundles/%s.js"></script>'
+                    u'<script src="http://example.com/map.js"></script>'
+                    u'<script src="/media/js/app.js"></script>'
+                    u'<script>init();</script>') % digest
+        self.assertEquals(expected, output)
+
+    def test_missing_file(self):
+        m = self.get_manager()
+        m.add_external("missing.js", "js", ["jquery-ui.js"])
+        output = renderers.render_requirements(m.get_sorted_requirements(), None)
+        self.assertEquals(u'<script src="/media/js/jquery.js"></script><script src="/media/js/jquery-ui.js"></script><script src="/media/js/missing.js"></script>', output)
+
+    def test_css_relative_urls(self):
+        settings.attributes["BUNDLE_GROUPS"] = ["css"]
+        os.mkdir(os.path.join(self.media_root, "css", "ui"))
+        self.write("css/reset.css", '@charset "utf-8";\n@import "base.css";\nbody { background: url(img/bg.png); }')
+        self.write("css/ui/theme.css", '@charset "utf-8";\n.icon { background: url("../icons/a.png"), url(/media/b.png), url(data:image/png;base64,AA==); }')
+        m = manager.RequirementManager()
+        m.add_external("ui/theme.css", "css", ["reset.css"])
+        m.add_external("reset.css", "css")
+        output = renderers.render_requirements(m.get_sorted_requirements(), None)
+        content = ('@charset "utf-8";\n@import "/media/css/base.css";\nbody { background: url(/media/css/img/bg.png); }\n'
+                   '.icon { background: url("/media/css/icons/a.png"), url(/media/b.png), url(data:image/png;base64,AA==); }')
+        name = "require_media/bundles/%s.css" % hashlib.md5(content).hexdigest()
+        self.assertEquals(u'<link rel="stylesheet" type="text/css" href="/media/%s">' % name, output)
+        self.assertEquals(content, test_storage.open(name).read())
+
+    def test_css_import_not_bundled(self):
+        settings.attributes["BUNDLE_GROUPS"] = ["css"]
+        self.write("css/reset.css", "body { margin: 0; }")
+        self.write("css/theme.css", '@import url(fonts.css);')
+        m = manager.RequirementManager()
+        m.add_external("theme.css", "css", ["reset.css"])
+        m.add_external("reset.css", "css")
+        output = renderers.render_requirements(m.get_sorted_requirements(), None)
+        self.assertEquals(u'<link rel="stylesheet" type="text/css" href="/media/css/reset.css">'
+                          u'<link rel="stylesheet" type="text/css" href="/media/css/theme.css">', output)
+
+
+class URLManifestTestCase(MediaRootTestCase):
+    def setUp(self):
+        super(URLManifestTestCase, self).setUp()
+        self.write("manifest.json", '{"js/jquery.js": "js/jquery.0123abcd.js"}')
+        settings.attributes["URL_MANIFEST"] = os.path.join(self.media_root, "manifest.json")
+
+    def tearDown(self):
+        super(URLManifestTestCase, self).tearDown()
+        renderers.url_manifest.load()
+
+    def test_hashed_url(self):
+        renderer = renderers.javascript_requirement_renderer
+        self.assertEquals("/media/js/jquery.0123abcd.js", renderer.build_url(manager.ExternalRequirement("jquery.js", "js")))
+        self.assertEquals("/media/js/other.js", renderer.build_url(manager.ExternalRequirement("other.js", "js")))
+
+    def test_staticfiles_format(self):
+        self.write("manifest.json", '{"paths": {"css/reset.css": "css/reset.4567.css"}, "version": "1.0"}')
+        renderers.url_manifest.load()
+        requirement = manager.ExternalRequirement("reset.css", "css")
+        self.assertEquals("/media/css/reset.4567.css", renderers.css_requirement_renderer.build_url(requirement))
+
+    def test_version(self):
+        renderers.url_manifest.load()
+        version = renderers.url_manifest.version
+        self.assertTrue(version)
+        requirements = [manager.ExternalRequirement("jquery.js", "js")]
+        key = renderers.fragment_cache.make_key(requirements)
+        self.write("manifest.json", '{"js/jquery.js": "js/jquery.4567cdef.js"}')
+        renderers.url_manifest.load()
+        self.assertNotEquals(version, renderers.url_manifest.version)
+        self.assertNotEquals(key, renderers.fragment_cache.make_key(requirements))
+
+    def test_invalid_manifest(self):
+        self.write("manifest.json", "{")
+        self.assertRaises(ImproperlyConfigured, renderers.url_manifest.load)
+
+
+class IntegrityTestCase(MediaRootTestCase):
+    overrides = {"SUBRESOURCE_INTEGRITY": True}
+
+    def setUp(self):
+        super(IntegrityTestCase, self).setUp()
+        renderers.integrity_cache.clear()
+        self.write("js/jquery.js", "var jQuery;")
+
+    def expected(self, content):
+        return "sha384-" + base64.b64encode(hashlib.sha384(content).digest())
+
+    def test_local_file(self):
+        requirement = manager.ExternalRequirement("jquery.js", "js")
+        output = renderers.javascript_requirement_renderer.render(requirement, None)
+        expected = '<script src="/media/js/jquery.js" integrity="%s" crossorigin="anonymous"></script>' % self.expected("var jQuery;")
+        self.assertEquals(expected, output)
+
+    def test_cached(self):
+        requirement = manager.ExternalRequirement("jquery.js", "js")
+        renderer = renderers.javascript_requirement_renderer
+        integrity = renderer.get_integrity(requirement)
+        self.write("js/jquery.js", "var $;")
+        self.assertEquals(integrity, renderer.get_integrity(requirement))
+        settings.attributes["INTEGRITY_CHECK_MTIME"] = True
+        os.utime(os.path.join(self.media_root, "js", "jquery.js"), (0, 0))
+        self.assertEquals(self.expected("var $;"), renderer.get_integrity(requirement))
+
+    def test_pinned_and_qualified(self):
+        settings.attributes["INTEGRITY_HASHES"] = {"http://example.com/map.js": "sha384-pinned"}
+        renderer = renderers.javascript_requirement_renderer
+        self.assertEquals("sha384-pinned", renderer.get_integrity(manager.ExternalRequirement("http://example.com/map.js", "js")))
+        output = renderer.render(manager.ExternalRequirement("http://example.com/other.js", "js"), None)
+        self.assertEquals('<script src="http://example.com/other.js"></script>', output)
+
+    def test_missing_file(self):
+        output = renderers.css_requirement_renderer.render(manager.ExternalRequirement("missing.css", "css"), None)
+        self.assertEquals('<link rel="stylesheet" type="text/css" href="/media/css/missing.css">', output)
+
+    def test_manifest(self):
+        self.write("manifest.json", '{"paths": {"js/app.js": "js/app.1234.js"}, "integrity": {"js/app.js": "sha384-built"}}')
+        settings.attributes["URL_MANIFEST"] = os.path.join(self.media_root, "manifest.json")
+        try:
+            requirement = manager.ExternalRequirement("app.js", "js")
+            self.assertEquals("sha384-built", renderers.javascript_requirement_renderer.get_integrity(requirement))
+        finally:
+            del settings.attributes["URL_MANIFEST"]
+            renderers.url_manifest.load()
+
+    def test_fragment_key(self):
+        settings.attributes["INTEGRITY_CHECK_MTIME"] = True
+        requirements = [manager.ExternalRequirement("jquery.js", "js")]
+        key = renderers.fragment_cache.make_key(requirements)
+        self.write("js/jquery.js", "var $;")
+        os.utime(os.path.join(self.media_root, "js", "jquery.js"), (0, 0))
+        self.assertNotEquals(key, renderers.fragment_cache.make_key(requirements))
+
+    def test_bundle(self):
+        settings.attributes["BUNDLE_GROUPS"] = ["js"]
+        renderers.bundle_cache.clear()
+        try:
+            self.write("js/app.js", "var app;")
+            m = manager.RequirementManager()
+            m.add_external("app.js", "js", ["jquery.js"])
+            m.add_external("jquery.js", "js")
+            output = renderers.render_requirements(m.get_sorted_requirements(), None)
+            content = "var jQuery;\n;\nvar app;"
+            expected = (u'<script src="/media/require_media/bundles/%s.js" integrity="%s" crossorigin="anonymous"></script>'
+                        % (hashlib.md5(content).hexdigest(), self.expected(content)))
+            self.assertEquals(expected, output)
+        finally:
+            renderers.bundle_cache.clear()
+
+    def test_bundle_rebuilt(self):
+        settings.attributes["INTEGRITY_CHECK_MTIME"] = True
+        renderer = renderers.javascript_requirement_renderer
+        requirements = [manager.ExternalRequirement("jquery.js", "js")]
+        renderers.bundle_cache.clear()
+        try:
+            url, integrity = renderer.build_bundle(requirements)
+            self.write("js/jquery.js", "var $;")
+            os.utime(os.path.join(self.media_root, "js", "jquery.js"), (0, 0))
+            self.assertEquals(self.expected("var $;"), renderer.build_bundle(requirements)[1])
+        finally:
+            renderers.bundle_cache.clear()
+
+
+class InlinePromotionTestCase(MediaRootTestCase):
+    overrides = {"INLINE_PROMOTION_THRESHOLD": 20}
+
+    def setUp(self):
+        super(InlinePromotionTestCase, self).setUp()
+        renderers.promotion_cache.clear()
+
+    def test_small_inline(self):
+        requirement = manager.InlineRequirement("setup", u"init();", "js")
+        output = renderers.javascript_requirement_renderer.render(requirement, None)
+        self.assertEquals(u"<script>init();</script>", output)
+
+    def test_promoted(self):
+        content = u"#sidebar { float: left; }"
+        requirement = manager.InlineRequirement("sidebar", content, "css", static=True)
+        output = renderers.css_requirement_renderer.render(requirement, None)
+        name = "require_media/inline/%s.css" % hashlib.md5(content).hexdigest()
+        self.assertEquals(u'<link rel="stylesheet" type="text/css" href="/media/%s">' % name, output)
+        self.assertEquals(content, test_storage.open(name).read())
+
+    def test_promoted_integrity(self):
+        settings.attributes["SUBRESOURCE_INTEGRITY"] = True
+        content = u"#sidebar { float: left; }"
+        requirement = manager.InlineRequirement("sidebar", content, "css", static=True)
+        output = renderers.css_requirement_renderer.render(requirement, None)
+        name = "require_media/inline/%s.css" % hashlib.md5(content).hexdigest()
+        integrity = "sha384-" + base64.b64encode(hashlib.sha384(content).digest())
+        expected = u'<link rel="stylesheet" type="text/css" href="/media/%s" integrity="%s" crossorigin="anonymous">' % (name, integrity)
+        self.assertEquals(expected, output)
+
+    def test_written_once(self):
+        for i in range(2):
+            requirement = manager.InlineRequirement("setup", u"window.setup = function() {};", "js", static=True)
+            renderers.javascript_requirement_renderer.render(requirement, None)
+        self.assertEquals(1, renderers.promotion_cache.stats()["hits"])
+        self.assertEquals(1, len(os.listdir(os.path.join(self.media_root, "require_media", "inline"))))
+
+    def test_dynamic_not_promoted(self):
+        t = template.Template("{% load require_media_tags %}{% require_inline setup js %}window.user = '{{ user }}';{% end_require_inline %}")
+        requirement = t.nodelist[1].node
+        self.assertFalse(requirement.static)
+        output = renderers.javascript_requirement_renderer.render(requirement, template.Context({"user": "alice"}))
+        self.assertEquals(u"<script>window.user = 'alice';</script>", output)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "require_media", "inline")))
+
+    def test_runtime_string_not_promoted(self):
+        m = manager.RequirementManager()
+        m.add_inline("user", u"window.user = {\"name\": \"alice\"};", "js")
+        output = renderers.render_requirements(m.get_sorted_requirements(), None)
+        self.assertEquals(u'<script>window.user = {"name": "alice"};</script>', output)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "require_media", "inline")))
+        m = manager.RequirementManager()
+        m.add_inline("setup", u"window.setup = function() {};", "js", static=True)
+        output = renderers.render_requirements(m.get_sorted_requirements(), None)
+        self.assertTrue(output.startswith(u'<script src="/media/require_media/inline/'))
+
+    def test_static_nodelist_promoted(self):
+        t = template.Template("{% load require_media_tags %}{% require_inline setup js %}window.setup = function() {};{% end_require_inline %}")
+        requirement = t.nodelist[1].node
+        self.assertTrue(requirement.static)
+        output = renderers.javascript_requirement_renderer.render(requirement, template.Context({}))
+        self.assertTrue(output.startswith(u'<script src="/media/require_media/inline/'))
+
+
+class MinifierTestCase(unittest.TestCase):
+    def test_minify_css(self):
+        css = u"/* reset */\nbody , h1 > a {\n  color: red ;\n  content: \" { ; } \";\n}\n"
+        self.assertEquals(u'body,h1>a{color: red;content: " { ; } "}', minifiers.minify_css(css))
+
+    def test_minify_css_keeps_descendant_pseudo_selectors(self):
+        self.assertEquals(u"div :hover{margin:0}", minifiers.minify_css(u"div :hover { margin:0; }"))
+
+    def test_minify_js_comments_and_strings(self):
+        js = u'// setup\nvar a = 1;  /* block */ var b = "x // y";\n'
+        self.assertEquals(u'var a=1;var b="x // y";', minifiers.minify_js(js))
+
+    def test_minify_js_regex_literals(self):
+        js = u"if (a) {\n    c = /a\\/b[/]/g.test(b); // test\n}\nreturn /x/.test(s);"
+        self.assertEquals(u"if(a){c=/a\\/b[/]/g.test(b);}\nreturn /x/.test(s);", minifiers.minify_js(js))
+
+    def test_minify_js_keeps_significant_whitespace(self):
+        self.assertEquals(u"var d=a + +b\nd++", minifiers.minify_js(u"var d = a + +b\n\n  d++"))
+        self.assertEquals(u"x=a / 2 / b", minifiers.minify_js(u"x = a / 2 / b"))
+
+
+class InlineMinificationTestCase(unittest.TestCase):
+    def setUp(self):
+        renderers.minify_cache.clear()
+        self.renderer = renderers.JavaScriptRequirementRenderer()
+        self.renderer.inline_minifier = "require_media.minifiers.minify_js"
+
+    def test_render_inline(self):
+        requirement = manager.InlineRequirement("setup", u"var a = 1; // comment\n", "js")
+        self.assertEquals(u"<script>var a=1;</script>", self.renderer.render(requirement, None))
+
+    def test_memoized(self):
+        for name in ("first", "second"):
+            requirement = manager.InlineRequirement(name, u"var a = 1;", "js")
+            self.renderer.render(requirement, None)
+        self.assertEquals(1, renderers.minify_cache.stats()["hits"])
+        self.assertEquals(1, len(renderers.minify_cache))
+
+    def test_disabled_by_default(self):
+        requirement = manager.InlineRequirement("setup", u"var a = 1; // comment", "js")
+        output = renderers.javascript_requirement_renderer.render(requirement, None)
+        self.assertEquals(u"<script>var a = 1; // comment</script>", output)
+
 
 class RequestMiddlewareTestCase(DjangoTestCase):
+    def tearDown(self):
+        # get_request runs process_request without process_response
+        utils.current_request.set(None)
+
     def get_request(self):
         request = request_factory.get("/")
         self.apply_middleware(request)
@@ -183,8 +1020,8 @@ class RequestMiddlewareTestCase(DjangoTestCase):
 
     def apply_middleware(self, request):
         request_middleware = self.get_middleware()
-        for middleware in request_middleware:
-            middleware(request)
+        for process_request in request_middleware:
+            process_request(request)
 
 
 class RequireMediaMiddlewareTestCase(RequestMiddlewareTestCase):
@@ -192,14 +1029,318 @@ class RequireMediaMiddlewareTestCase(RequestMiddlewareTestCase):
         response = self.client.get("/example1/")
         self.assertEquals(200, response.status_code)
 
-    def test_middleware_adds_manager(self):
+    def test_manager_created_lazily(self):
         request = self.get_request()
-        requirement_manager = getattr(request, settings.REQUEST_ATTR_NAME, None)
-        self.assertTrue(requirement_manager)
+        self.assertEquals(None, getattr(request, settings.REQUEST_ATTR_NAME, None))
+        requirement_manager = utils.get_manager(request)
         self.assertTrue(isinstance(requirement_manager, manager.RequirementManager))
+        self.assertTrue(requirement_manager is utils.get_manager(request))
+        self.assertTrue(requirement_manager is getattr(request, settings.REQUEST_ATTR_NAME))
+
+    def test_context_processor_creates_manager(self):
+        from require_media.context_processors import require_media
+        request = self.get_request()
+        context = require_media(request)
+        self.assertTrue(isinstance(context[settings.CONTEXT_VAR_NAME], manager.RequirementManager))
+        self.assertTrue(context[settings.CONTEXT_VAR_NAME] is getattr(request, settings.REQUEST_ATTR_NAME))
+
+    def test_response_without_manager(self):
+        from django.http import HttpResponse
+        request = self.get_request()
+        response = middleware.RequireMediaMiddleware().process_response(request, HttpResponse("{}"))
+        self.assertEquals("{}", response.content)
+        self.assertEquals(None, getattr(request, settings.REQUEST_ATTR_NAME, None))
+
+
+class RequestScopeTestCase(unittest.TestCase):
+    def test_no_current_manager(self):
+        self.assertEquals(None, utils.get_current_manager())
+
+    def test_call(self):
+        from django.http import HttpResponse
+        seen = []
+        def get_response(request):
+            seen.append(utils.get_current_manager())
+            seen[0].add_external("a.js", "js")
+            return HttpResponse("")
+        request = request_factory.get("/")
+        middleware.RequireMediaMiddleware(get_response)(request)
+        self.assertTrue(seen[0] is getattr(request, settings.REQUEST_ATTR_NAME))
+        self.assertEquals(None, utils.get_current_manager())
+
+    def test_process_request(self):
+        from django.http import HttpResponse
+        request = request_factory.get("/")
+        instance = middleware.RequireMediaMiddleware()
+        instance.process_request(request)
+        self.assertTrue(utils.get_current_manager() is utils.get_manager(request))
+        instance.process_response(request, HttpResponse(""))
+        self.assertEquals(None, utils.get_current_manager())
+
+    def test_process_response_restores_scope(self):
+        from django.http import HttpResponse
+        outer = request_factory.get("/outer/")
+        token = utils.current_request.set(outer)
+        try:
+            request = request_factory.get("/")
+            instance = middleware.RequireMediaMiddleware()
+            instance.process_request(request)
+            instance.process_response(request, HttpResponse(""))
+            self.assertTrue(utils.current_request.get() is outer)
+        finally:
+            utils.current_request.reset(token)
+        self.assertEquals(None, utils.current_request.get())
+
+    def test_threads(self):
+        import threading
+        from django.http import HttpResponse
+        managers = {}
+        def get_response(request):
+            managers[request.path] = utils.get_current_manager()
+            return HttpResponse("")
+        instance = middleware.RequireMediaMiddleware(get_response)
+        requests = [request_factory.get("/%d/" % i) for i in range(2)]
+        threads = [threading.Thread(target=instance, args=(request,)) for request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for request in requests:
+            self.assertTrue(managers[request.path] is getattr(request, settings.REQUEST_ATTR_NAME))
+
+
+class RequirementDigestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original_settings = settings.attributes.copy()
+
+    def tearDown(self):
+        settings.attributes = self.original_settings
+
+    def build(self, *names):
+        m = manager.RequirementManager()
+        for name in names:
+            m.add_external(name, "js")
+        return m
+
+    def test_stable(self):
+        self.assertEquals(self.build("a.js", "b.js").get_digest(), self.build("a.js", "b.js").get_digest())
+        self.assertNotEquals(self.build("a.js", "b.js").get_digest(), self.build("b.js", "a.js").get_digest())
+        self.assertNotEquals(self.build("a.js").get_digest(), self.build("a.js", "b.js").get_digest())
+
+    def test_updated(self):
+        m = self.build("a.js")
+        digest = m.get_digest()
+        self.assertEquals(digest, m.get_digest())
+        m.add_external("b.js", "js")
+        self.assertEquals(self.build("a.js", "b.js").get_digest(), m.get_digest())
+
+    def test_asset_versions(self):
+        digest = self.build("a.js").get_digest()
+        settings.attributes["INTEGRITY_HASHES"] = {"a.js": "sha384-abc"}
+        self.assertNotEquals(digest, self.build("a.js").get_digest())
+
+    def test_inline_content(self):
+        a = manager.RequirementManager()
+        a.add_inline("setup", u"init(1);", "js")
+        b = manager.RequirementManager()
+        b.add_inline("setup", u"init(2);", "js")
+        self.assertNotEquals(a.get_digest(), b.get_digest())
+
+
+class RequirementETagTestCase(unittest.TestCase):
+    def get_response(self, content="<html></html>", etag=None, cache_control=None, **headers):
+        from django.http import HttpResponse
+        request = request_factory.get("/", **headers)
+        utils.get_manager(request).add_external("a.js", "js")
+        response = HttpResponse(content)
+        if etag:
+            response["ETag"] = etag
+        if cache_control:
+            response["Cache-Control"] = cache_control
+            response["Vary"] = "Accept-Encoding"
+            response["Content-Length"] = str(len(content))
+        return middleware.RequirementETagMiddleware().process_response(request, response)
+
+    def test_etag(self):
+        etag = self.get_response()["ETag"]
+        self.assertEquals(etag, self.get_response()["ETag"])
+        self.assertNotEquals(etag, self.get_response("<html>changed</html>")["ETag"])
+        self.assertNotEquals(etag, self.get_response(etag='"view"')["ETag"])
+
+    def test_not_modified(self):
+        etag = self.get_response()["ETag"]
+        response = self.get_response(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(304, response.status_code)
+        self.assertEquals(etag, response["ETag"])
+        self.assertEquals(200, self.get_response(HTTP_IF_NONE_MATCH='"other"').status_code)
+
+    def test_not_modified_keeps_headers(self):
+        etag = self.get_response()["ETag"]
+        response = self.get_response(HTTP_IF_NONE_MATCH=etag, cache_control="max-age=60")
+        self.assertEquals(304, response.status_code)
+        self.assertEquals("", response.content)
+        self.assertEquals("max-age=60", response["Cache-Control"])
+        self.assertEquals("Accept-Encoding", response["Vary"])
+        self.assertFalse(response.has_header("Content-Length"))
+
+    def test_get_response(self):
+        from django.http import HttpResponse
+        def get_response(request):
+            utils.get_manager(request).add_external("a.js", "js")
+            return HttpResponse("<html></html>")
+        etag_middleware = middleware.RequirementETagMiddleware(get_response)
+        etag = self.get_response()["ETag"]
+        self.assertEquals(etag, etag_middleware(request_factory.get("/"))["ETag"])
+        self.assertEquals(304, etag_middleware(request_factory.get("/", HTTP_IF_NONE_MATCH=etag)).status_code)
+
+    def test_without_manager(self):
+        from django.http import HttpResponse
+        response = middleware.RequirementETagMiddleware().process_response(request_factory.get("/"), HttpResponse(""))
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_placeholders_substituted(self):
+        from django.http import HttpResponse
+        request = request_factory.get("/")
+        m = utils.get_manager(request)
+        response = HttpResponse(m.add_placeholder(["js"], None))
+        m.add_external("a.js", "js")
+        response = middleware.RequirementETagMiddleware().process_response(request, response)
+        self.assertEquals('<script src="/media/js/a.js"></script>', response.content)
+        self.assertEquals([], m.placeholders)
+
+    def test_decorator(self):
+        from django.http import HttpResponse
+        from require_media.decorators import requirement_etag
+        def view(request):
+            utils.get_manager(request).add_external("a.js", "js")
+            return HttpResponse("")
+        response = requirement_etag(view)(request_factory.get("/"))
+        self.assertTrue(response.has_header("ETag"))
+
+
+early_hints = []
+
+def record_early_hints(request, links):
+    early_hints.append((request.path, links))
+
+
+class PreloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original_settings = settings.attributes.copy()
+        settings.attributes["PRELOAD_LINK_COUNT"] = 2
+        settings.attributes["EARLY_HINTS_HANDLER"] = "require_media.tests.record_early_hints"
+        del early_hints[:]
+        self.middleware = middleware.RequireMediaMiddleware()
+
+    def tearDown(self):
+        settings.attributes = self.original_settings
+
+    def get_response(self, path="/"):
+        from django.http import HttpResponse
+        request = request_factory.get(path)
+        self.middleware.process_request(request)
+        m = utils.get_manager(request)
+        m.add_external("jquery-ui.js", "js", ["jquery.js", "reset.css"])
+        m.add_inline("setup", "init();", "js", ["jquery.js"])
+        m.add_external("jquery.js", "js", ["reset.css"])
+        m.add_external("reset.css", "css")
+        return self.middleware.process_response(request, HttpResponse("<html></html>"))
+
+    def test_link_header(self):
+        response = self.get_response()
+        self.assertEquals("</media/css/reset.css>; rel=preload; as=style, </media/js/jquery.js>; rel=preload; as=script", response["Link"])
+
+    def test_integrity(self):
+        settings.attributes["SUBRESOURCE_INTEGRITY"] = True
+        settings.attributes["INTEGRITY_HASHES"] = {"jquery.js": "sha384-pinned"}
+        renderers.integrity_cache.clear()
+        try:
+            response = self.get_response()
+        finally:
+            renderers.integrity_cache.clear()
+        self.assertEquals('</media/css/reset.css>; rel=preload; as=style, '
+                          '</media/js/jquery.js>; rel=preload; as=script; crossorigin=anonymous; integrity="sha384-pinned"',
+                          response["Link"])
+
+    def test_disabled(self):
+        settings.attributes["PRELOAD_LINK_COUNT"] = 0
+        self.assertFalse(self.get_response().has_header("Link"))
+
+    def test_early_hints(self):
+        self.get_response("/page/")
+        self.assertEquals([], early_hints)
+        self.get_response("/page/")
+        self.assertEquals(1, len(early_hints))
+        self.assertEquals("/page/", early_hints[0][0])
+        self.assertEquals(2, len(early_hints[0][1]))
+
+
+class InstrumentationTestCase(RequestMiddlewareTestCase):
+    def setUp(self):
+        self.original_settings = settings.attributes.copy()
+        settings.attributes["INSTRUMENTATION"] = True
+        self.received = []
+        signals.requirements_rendered.connect(self.receive)
+
+    def tearDown(self):
+        signals.requirements_rendered.disconnect(self.receive)
+        settings.attributes = self.original_settings
+        super(InstrumentationTestCase, self).tearDown()
+
+    def receive(self, sender, request, stats, **kwargs):
+        self.received.append(stats)
+
+    def render(self, source):
+        from django.http import HttpResponse
+        request = self.get_request()
+        t = template.Template("{% load require_media_tags %}" + source)
+        response = HttpResponse(t.render(template.RequestContext(request)))
+        return middleware.RequireMediaMiddleware().process_response(request, response)
+
+    def test_disabled(self):
+        settings.attributes["INSTRUMENTATION"] = False
+        requirement_manager = manager.RequirementManager()
+        self.assertEquals(None, requirement_manager.stats)
+        self.assertEquals(None, requirement_manager.get_stats())
+
+    def test_signal(self):
+        self.render("{% require js a.js %}{% require_inline b js a.js %}b();{% end_require_inline %}{% require css c.css %}{% render_requirements js %}")
+        self.assertEquals(1, len(self.received))
+        stats = self.received[0]
+        self.assertEquals(3, stats["count"])
+        self.assertEquals({"js": 2, "css": 1}, stats["groups"])
+        self.assertTrue(stats["render_time"] >= stats["inline_time"] >= 0)
+        self.assertTrue(stats["sort_time"] >= 0)
+
+    def test_no_signal_without_manager(self):
+        from django.http import HttpResponse
+        middleware.RequireMediaMiddleware().process_response(self.get_request(), HttpResponse(""))
+        self.assertEquals([], self.received)
+
+    def test_header(self):
+        settings.attributes["STATS_HEADER"] = "X-Require-Media-Stats"
+        response = self.render("{% require js a.js %}{% require css c.css %}")
+        self.assertTrue(response["X-Require-Media-Stats"].startswith("count=2; groups=css=1, js=1; sort="))
+
+    def test_no_header_by_default(self):
+        response = self.render("{% require js a.js %}")
+        self.assertFalse(response.has_header("X-Require-Media-Stats"))
 
 
 class RequireTagTestCase(RequestMiddlewareTestCase):
+    def test_shared_requirement(self):
+        t = template.Template("{% load require_media_tags %}{% require js jquery-ui.js jquery.js %}{% require_inline setup js %}init();{% end_require_inline %}")
+        managers = []
+        for i in range(2):
+            request = self.get_request()
+            t.render(template.RequestContext(request))
+            managers.append(getattr(request, settings.REQUEST_ATTR_NAME))
+        first, second = managers
+        self.assertTrue(first.requirements[0] is second.requirements[0])
+        self.assertTrue(first.requirements[1] is second.requirements[1])
+        self.assertEquals(("jquery.js",), first.requirements[0].depends_on)
+        self.assertEquals("/media/js/jquery-ui.js", first.requirements[0].url[2])
+
     def test_simple_with_group(self):
         request = self.get_request()
         t = template.Template("{% load require_media_tags %}{% require js jquery.js %}")
@@ -261,6 +1402,42 @@ class RequireTagTestCase(RequestMiddlewareTestCase):
         self.assertEquals(0, len(requirement_manager.requirements[0].depends_on))
 
 
+class PriorityTagTestCase(RequestMiddlewareTestCase):
+    def test_priority(self):
+        request = self.get_request()
+        t = template.Template("{% load require_media_tags %}{% require js app.js %}{% require js analytics.js priority=-1 %}{% require_inline setup js priority=-2 %}init();{% end_require_inline %}")
+        t.render(template.RequestContext(request))
+        requirement_manager = getattr(request, settings.REQUEST_ATTR_NAME)
+        self.assertEquals(["setup", "analytics.js", "app.js"], [r.name for r in requirement_manager.get_sorted_requirements()])
+
+    def test_invalid_priority(self):
+        self.assertRaises(template.TemplateSyntaxError, template.Template,
+                          "{% load require_media_tags %}{% require js app.js priority=high %}")
+
+
+class RequireManyTagTestCase(RequestMiddlewareTestCase):
+    def test_registers_all(self):
+        request = self.get_request()
+        t = template.Template("""{% load require_media_tags %}{% require_many %}
+            {% require js jquery-ui.js jquery.js %}
+            {% require_inline setup js jquery-ui.js %}init();{% end_require_inline %}
+            {% require jquery.js %}
+        {% end_require_many %}""")
+        self.assertEquals("", t.render(template.RequestContext(request)))
+        requirement_manager = getattr(request, settings.REQUEST_ATTR_NAME)
+        names = [requirement.name for requirement in requirement_manager.get_sorted_requirements()]
+        self.assertEquals(["jquery.js", "jquery-ui.js", "setup"], names)
+
+    def test_invalid_content(self):
+        self.assertRaises(template.TemplateSyntaxError, template.Template,
+                          "{% load require_media_tags %}{% require_many %}text{% end_require_many %}")
+
+    def test_analysis(self):
+        t = template.Template("{% load require_media_tags %}{% require_many %}{% require js a.js %}{% require js b.js a.js %}{% end_require_many %}")
+        names = [node.requirement for node in analysis.iter_requirement_nodes(t.nodelist)]
+        self.assertEquals(["a.js", "b.js"], names)
+
+
 class RequireInlineTagTestCase(RequestMiddlewareTestCase):
     def test_simple(self):
         request = self.get_request()
@@ -359,3 +1536,125 @@ class RenderRequirementsTagTestCase(RequestMiddlewareTestCase):
         t = template.Template(u'{% load require_media_tags %}{% require http://openlayers.org/api/OpenLayers.js %}{% require css layout.css %}{% render_requirements js css %}')
         rendered = t.render(template.RequestContext(request))
         self.assertEquals(u'<script src="http://openlayers.org/api/OpenLayers.js"></script><link rel="stylesheet" type="text/css" href="/media/css/layout.css">', rendered)
+
+
+class StreamingTestCase(RequestMiddlewareTestCase):
+    def stream(self, *sources, **kwargs):
+        from require_media.streaming import stream_templates
+        request = self.get_request()
+        templates = [template.Template("{% load require_media_tags %}" + source) for source in sources]
+        return list(stream_templates(templates, template.RequestContext(request), **kwargs))
+
+    def test_flush_points(self):
+        chunks = self.stream("{% require css a.css %}<head>{% render_requirements css %}</head>",
+                             "{% require js app.js lib.js %}{% require js lib.js %}{% require css late.css %}<body>{% render_requirements js %}</body>")
+        self.assertEquals([u'<head><link rel="stylesheet" type="text/css" href="/media/css/a.css"></head>',
+                           u'<body><script src="/media/js/lib.js"></script><script src="/media/js/app.js"></script></body>',
+                           u'<link rel="stylesheet" type="text/css" href="/media/css/late.css">'], chunks)
+
+    def test_missing_dependency_held_back(self):
+        chunks = self.stream("{% require js app.js lib.js %}{% require js other.js %}{% render_requirements js %}",
+                             "{% require js lib.js %}")
+        self.assertEquals([u'<script src="/media/js/other.js"></script>', u'',
+                           u'<script src="/media/js/lib.js"></script><script src="/media/js/app.js"></script>'], chunks)
+
+    def test_head_groups(self):
+        chunks = self.stream("{% require css a.css %}{% require js a.js %}<head></head>", head_groups=["css"])
+        self.assertEquals([u'<head><link rel="stylesheet" type="text/css" href="/media/css/a.css"></head>',
+                           u'<script src="/media/js/a.js"></script>'], chunks)
+
+    def test_streaming_response(self):
+        from require_media.streaming import streaming_response
+        request = self.get_request()
+        t = template.Template("{% load require_media_tags %}{% require js a.js %}<p></p>")
+        response = streaming_response([t], template.RequestContext(request))
+        self.assertEquals('<p></p><script src="/media/js/a.js"></script>', "".join(response))
+
+
+class PlaceholderTestCase(RequestMiddlewareTestCase):
+    def setUp(self):
+        self.original_settings = settings.attributes.copy()
+        settings.attributes["PLACEHOLDER_MODE"] = True
+
+    def tearDown(self):
+        settings.attributes = self.original_settings
+        super(PlaceholderTestCase, self).tearDown()
+
+    def render(self, source):
+        from django.http import HttpResponse
+        request = self.get_request()
+        t = template.Template("{% load require_media_tags %}" + source)
+        response = HttpResponse(t.render(template.RequestContext(request)))
+        return middleware.RequireMediaMiddleware().process_response(request, response)
+
+    def test_placeholder(self):
+        request = self.get_request()
+        t = template.Template("{% load require_media_tags %}{% render_requirements js %}")
+        rendered = t.render(template.RequestContext(request))
+        self.assertEquals(manager.PLACEHOLDER_TEMPLATE % 0, rendered)
+
+    def test_replaced(self):
+        response = self.render("{% render_requirements css %}{% render_requirements js %}{% require js jquery-ui.js jquery.js %}{% require jquery.js %}{% require css reset.css %}")
+        self.assertEquals('<link rel="stylesheet" type="text/css" href="/media/css/reset.css"><script src="/media/js/jquery.js"></script><script src="/media/js/jquery-ui.js"></script>', response.content)
+
+    def test_wrapping_tags(self):
+        response = self.render("{% filter upper %}<p>{% render_requirements js %}</p>{% endfilter %}{% spaceless %}<div> {% render_requirements js %} </div>{% endspaceless %}{% require js a.js %}")
+        self.assertEquals('<P><script src="/media/js/a.js"></script></P><div><script src="/media/js/a.js"></script></div>', response.content)
+
+    def test_foreign_placeholder(self):
+        response = self.render("<!--require_media:0123:0-->{% render_requirements js %}{% require js a.js %}")
+        self.assertEquals('<!--require_media:0123:0--><script src="/media/js/a.js"></script>', response.content)
+
+
+@unittest.skipIf(jinja2 is None, "Jinja2 is not installed")
+class JinjaExtensionTestCase(RequestMiddlewareTestCase):
+    def setUp(self):
+        self.environment = jinja2.Environment(autoescape=True,
+            extensions=["require_media.jinja_extension.RequireMediaExtension"])
+
+    def render(self, get_response):
+        request = request_factory.get("/")
+        response = middleware.RequireMediaMiddleware(get_response)(request)
+        return response.content
+
+    def test_require(self):
+        from django.http import HttpResponse
+        t = self.environment.from_string('{% render_requirements "js" %}{% require "js", "jquery-ui.js", "jquery.js" %}{% require "jquery.js" %}')
+        content = self.render(lambda request: HttpResponse(t.render()))
+        self.assertEquals('<script src="/media/js/jquery.js"></script><script src="/media/js/jquery-ui.js"></script>', content)
+
+    def test_require_inline(self):
+        from django.http import HttpResponse
+        t = self.environment.from_string('{% render_requirements %}{% require_inline "setup", "js", "a.js" %}init({{ value }});{% end_require_inline %}{% require "js", "a.js" %}')
+        content = self.render(lambda request: HttpResponse(t.render(value=1)))
+        self.assertEquals('<script src="/media/js/a.js"></script><script>init(1);</script>', content)
+
+    def test_context_manager(self):
+        requirement_manager = manager.RequirementManager()
+        t = self.environment.from_string('{% require "js", "a.js" %}')
+        t.render({settings.CONTEXT_VAR_NAME: requirement_manager})
+        self.assertEquals(["a.js"], [requirement.name for requirement in requirement_manager.requirements])
+
+    def test_without_manager(self):
+        t = self.environment.from_string('{% require "js", "a.js" %}{% render_requirements %}')
+        self.assertEquals("", t.render())
+
+    def test_mixed(self):
+        from django.http import HttpResponse
+        jinja_template = self.environment.from_string('{% render_requirements "js" %}{% require "js", "b.js", "a.js" %}')
+        django_template = template.Template("{% load require_media_tags %}{% require js a.js %}")
+        def get_response(request):
+            output = jinja_template.render() + django_template.render(template.RequestContext(request))
+            return HttpResponse(output)
+        content = self.render(get_response)
+        self.assertEquals('<script src="/media/js/a.js"></script><script src="/media/js/b.js"></script>', content)
+
+    def test_static_inline(self):
+        extension = list(self.environment.extensions.values())[0]
+        self.environment.from_string('{% require_inline "a", "js" %}init();{% end_require_inline %}')
+        self.environment.from_string('{% require_inline "b", "js" %}init({{ value }});{% end_require_inline %}')
+        self.assertEquals([True, False], [requirement.static for requirement in extension.requirements])
+
+    def test_syntax_error(self):
+        self.assertRaises(jinja2.TemplateSyntaxError, self.environment.from_string, "{% require js %}")
+        self.assertRaises(jinja2.TemplateSyntaxError, self.environment.from_string, '{% require_inline "a" %}{% end_require_inline %}')
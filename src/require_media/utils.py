@@ -1,11 +1,28 @@
+import heapq
+import threading
 from os.path import splitext
 from urlparse import urlparse
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
 from django.core.urlresolvers import get_mod_func
 from django.utils.importlib import import_module
 
 from require_media.conf import settings
 
+try:
+    intern
+except NameError:
+    from sys import intern
+
+# Interned unicode requirement names; ``intern`` only accepts byte strings.
+# Only names from template tags are interned, so the table is bounded by
+# the templates in use.
+interned_names = {}
+
 def get_module_attribute(path):
     """
     Convert a string version of a function name to the callable object.
@@ -20,8 +37,71 @@ def get_module_attribute(path):
 def get_manager(request):
     """
     Get the requirements manager from a request object.
+
+    The manager is created on first access, so requests that never render
+    a template do not pay for one.
+    """
+    manager = getattr(request, settings.REQUEST_ATTR_NAME, None)
+    if manager is None:
+        from require_media.manager import RequirementManager
+        manager = RequirementManager()
+        setattr(request, settings.REQUEST_ATTR_NAME, manager)
+    return manager
+
+class RequestScope(object):
     """
-    return getattr(request, settings.REQUEST_ATTR_NAME)
+    The request being handled in the current context.
+
+    A context variable is used where available, so requests handled
+    concurrently in one thread each see their own; otherwise the request
+    is thread local.
+    """
+    def __init__(self):
+        if ContextVar is not None:
+            self.var = ContextVar("require_media_request", default=None)
+        else:
+            self.var = None
+            self.local = threading.local()
+
+    def get(self):
+        """
+        Return the current request, or ``None``.
+        """
+        if self.var is not None:
+            return self.var.get()
+        return getattr(self.local, "request", None)
+
+    def set(self, request):
+        """
+        Make a request current and return a token for ``reset``.
+        """
+        if self.var is not None:
+            return self.var.set(request)
+        token = self.get()
+        self.local.request = request
+        return token
+
+    def reset(self, token):
+        """
+        Restore the request that was current before a ``set``.
+        """
+        if self.var is not None:
+            self.var.reset(token)
+        else:
+            self.local.request = token
+
+# The request being handled, set by ``RequireMediaMiddleware``
+current_request = RequestScope()
+
+def get_current_manager():
+    """
+    Get the requirements manager of the current request, or ``None`` if no
+    request is being handled.
+    """
+    request = current_request.get()
+    if request is None:
+        return None
+    return get_manager(request)
 
 def determine_requirement_group(requirement, groups):
     """
@@ -34,44 +114,162 @@ def determine_requirement_group(requirement, groups):
         return extension
     return None
 
+def intern_name(name):
+    """
+    Return a canonical instance of a requirement or group name.
+    """
+    if name is None:
+        return None
+    if type(name) is str:
+        return intern(name)
+    return interned_names.setdefault(name, name)
+
+def split_priority(args):
+    """
+    Remove a ``priority=<n>`` argument from a list of tag arguments and
+    return the remaining arguments and the priority.
+
+    Raises ``ValueError`` if the priority is not an integer.
+    """
+    priority = 0
+    remaining = []
+    for arg in args:
+        if arg.startswith("priority="):
+            priority = int(arg[len("priority="):])
+        else:
+            remaining.append(arg)
+    return remaining, priority
+
+def resolve_require_arguments(args):
+    """
+    Resolve ``require`` tag arguments,
+    ``[group] requirement [depends ...] [priority=<n>]``, to a
+    ``(requirement, group, depends_on, priority)`` tuple with aliases
+    applied and names interned.
+
+    Raises ``ValueError`` if no requirement is given.
+    """
+    args, priority = split_priority(args)
+    group_aliases = settings.REQUIREMENT_GROUP_ALIASES or {}
+    requirement_aliases = settings.REQUIREMENT_ALIASES or {}
+    if not args:
+        raise ValueError("a requirement must be specified")
+    potential_group = group_aliases.get(args[0]) or args[0]
+    if potential_group and potential_group in settings.GROUPS:
+        if not len(args) >= 2:
+            raise ValueError("a requirement must be specified")
+        group = potential_group
+        args = args[1:]
+    else:
+        group = None
+    requirement = requirement_aliases.get(args[0]) or args[0]
+    depends_on = [requirement_aliases.get(dependency, dependency) for dependency in args[1:]]
+    if group is None:
+        group = determine_requirement_group(requirement, settings.GROUPS)
+    depends_on = [intern_name(dependency) for dependency in depends_on]
+    return intern_name(requirement), intern_name(group), depends_on, priority
+
+def resolve_require_inline_arguments(args):
+    """
+    Resolve ``require_inline`` tag arguments,
+    ``name group [depends ...] [priority=<n>]``, to a
+    ``(name, group, depends_on, priority)`` tuple with aliases applied and
+    names interned.
+
+    Raises ``ValueError`` if the name or group is missing.
+    """
+    args, priority = split_priority(args)
+    if not len(args) >= 2:
+        raise ValueError("a name and group must be specified")
+    requirement_aliases = settings.REQUIREMENT_ALIASES or {}
+    group_aliases = settings.REQUIREMENT_GROUP_ALIASES or {}
+    requirement = requirement_aliases.get(args[0]) or args[0]
+    group = group_aliases.get(args[1]) or args[1]
+    depends_on = [intern_name(requirement_aliases.get(dependency, dependency)) for dependency in args[2:]]
+    return intern_name(requirement), intern_name(group), depends_on, priority
+
 def update_graph(graph, name, dependencies):
     """
     Add a node reference to a dependency graph.
+
+    Returns a list of the dependencies that were not already arcs.
     """
     if name not in graph:
-        graph[name] = [0]
+        graph[name] = [0, set()]
+    arcs = graph[name][1]
+    added = []
     for dependency in dependencies:
-        graph[name].append(dependency)
+        if dependency in arcs:
+            continue
+        arcs.add(dependency)
+        added.append(dependency)
         if dependency not in graph:
-            graph[dependency] = [0]
+            graph[dependency] = [0, set()]
         graph[dependency][0] = graph[dependency][0] + 1
+    return added
+
+class CyclicDependencyError(ValueError):
+    """
+    Raised when requirements depend upon each other in a cycle.
+
+    ``nodes`` lists the names in the cycle, each depending on the next,
+    starting and ending with the same name.
+    """
+    def __init__(self, nodes):
+        self.nodes = nodes
+        super(CyclicDependencyError, self).__init__(
+            "Cyclic requirement dependencies: %s" % " -> ".join(nodes))
 
-def topological_sort(graph_dict):
+def topological_sort(graph_dict, key=None):
     """
     Sort a graph in order of fewest children to most.
 
     The graph is represented by a dictionary mapping node identifiers to an
-    info array of the form [num_incoming_arcs, <outgoing_arcs>...]
+    info array of the form [num_incoming_arcs, set(<outgoing_arcs>)]
 
-    See: http://www.logarithmic.net/pfh-files/blog/01208083168/sort.py
-         http://www.bitformation.com/art/python_toposort.html
+    Nodes are placed children first: each step places the node with the
+    lowest ``key``, or identifier if no key is given, among those whose
+    children have all been placed. The placed nodes are then returned in
+    reverse. The result depends only on the graph and the key. Raises
+    ``CyclicDependencyError`` if the graph has a cycle.
     """
-    graph = graph_dict.copy()
-    # First, we find the root nodes
-    roots = [node for node, info in graph.items() if info[0] == 0]
+    if key is None:
+        key = lambda node: node
+    # Arcs still to be satisfied for each node, and the reversed arcs
+    remaining = {}
+    parents = {}
+    for node, info in graph_dict.items():
+        remaining[node] = len(info[1])
+        for child in info[1]:
+            parents.setdefault(child, []).append(node)
+    ready = [(key(node), node) for node, count in remaining.items() if count == 0]
+    heapq.heapify(ready)
     ordered = []
-    # We then repeatedly emit a root node and remove it from the graph
-    # Children will become roots through this process
-    while len(roots) != 0:
-        root = roots.pop()
-        ordered.append(root)
-        # Remove references from this root
-        for child in graph[root][1:]:
-            graph[child][0] = graph[child][0] - 1
-            if graph[child][0] == 0:
-                roots.append(child)
-        del graph[root]
-    # If there are nodes left, they must form a cycle
-    if len(graph) != 0:
-        return None
+    while ready:
+        node = heapq.heappop(ready)[1]
+        ordered.append(node)
+        for parent in parents.get(node, ()):
+            remaining[parent] -= 1
+            if remaining[parent] == 0:
+                heapq.heappush(ready, (key(parent), parent))
+    if len(ordered) != len(graph_dict):
+        raise CyclicDependencyError(find_cycle(graph_dict, remaining, key))
+    ordered.reverse()
     return ordered
+
+def find_cycle(graph_dict, remaining, key):
+    """
+    Return a cycle among the nodes ``topological_sort`` could not place.
+
+    Every unplaced node has an arc to another unplaced node, so following
+    such arcs from any of them must come back to a node already visited.
+    """
+    unplaced = [node for node, count in remaining.items() if count]
+    path = [min(unplaced, key=key)]
+    visited = set(path)
+    while True:
+        node = min([child for child in graph_dict[path[-1]][1] if remaining[child]], key=key)
+        if node in visited:
+            return path[path.index(node):] + [node]
+        path.append(node)
+        visited.add(node)